@@ -1,72 +1,122 @@
-from flask import Flask, request, jsonify
+import hmac
+import time
+_IMPORT_T0 = time.perf_counter()
+
+from flask import Flask, Blueprint, request, jsonify, current_app, Response
 from flask_cors import CORS
-from flask_jwt_extended import JWTManager, create_access_token, jwt_required
-from passlib.hash import bcrypt
-from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
+from flask_jwt_extended import create_access_token, jwt_required
+from itsdangerous import BadSignature, SignatureExpired
 from datetime import timedelta
+import atexit
 import os
-import psycopg2
-from psycopg2.extras import RealDictCursor
-from pymongo import MongoClient
-from flask_jwt_extended import JWTManager, create_access_token, jwt_required
-from flask_mail import Mail, Message
 from datetime import datetime, date
 from flask_jwt_extended import get_jwt
 from bson import ObjectId
 from flask_jwt_extended import get_jwt_identity
-
-app = Flask(__name__)
-CORS(app)
-
-
-app.config["MAIL_SERVER"] = "mailhog"
-app.config["MAIL_PORT"] = 1025
-app.config["MAIL_USE_TLS"] = False
-app.config["MAIL_USE_SSL"] = False
-app.config["MAIL_DEFAULT_SENDER"] = "noreply@miapp.com"
-
-mail = Mail(app)
-
-
-# Config
-app.config["JWT_SECRET_KEY"] = os.getenv("JWT_SECRET", "dev")
-app.config["JWT_ACCESS_TOKEN_EXPIRES"] = timedelta(hours=6)
-jwt = JWTManager(app)
-s = URLSafeTimedSerializer(app.config["JWT_SECRET_KEY"])
-
-# Postgres
-pg = psycopg2.connect(os.getenv("DATABASE_URL"), cursor_factory=RealDictCursor)
-pg.autocommit = True
-with pg.cursor() as cur:
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS users(
-      id SERIAL PRIMARY KEY,
-      email TEXT UNIQUE NOT NULL,
-      password_hash TEXT NOT NULL,
-      created_at TIMESTAMP DEFAULT NOW()
-    );
-    """)
-
-# Mongo
-mongo = MongoClient(os.getenv("MONGODB_URI"))
-mdb = mongo.app
-metrics = mdb.metrics
-if metrics.count_documents({}) == 0:
-    metrics.insert_many([
-        {"name": "Entrenamientos completados", "value": 24},
-        {"name": "Horas totales de entrenamiento", "value": 18},
-        {"name": "Promedio de calorías por sesión", "value": 420},
-        {"name": "Racha activa (días)", "value": 6},
-        {"name": "Sesiones de fuerza", "value": 14},
-        {"name": "Sesiones de cardio", "value": 10}
-    ])
-
-
-@app.get("/api/health")
+from db import PoolTimeout
+from psycopg2.errors import UniqueViolation
+from hashing import HashingBusy
+from ratelimit import RateLimited
+from rollups import RollupStore
+from views import GlobalViews
+import extensions
+from extensions import (mail, jwt, mongo, mdb, metrics, metrics_log, pg_pool, hasher,
+                        rollups, response_cache, outbox, rate_limiter, serializer,
+                        dashboard_executor, write_buffer, global_views)
+import indexes
+import instrumentation
+import migrations
+from metrics_schema import ITEM_PROJECTION, METRIC_TYPES, metric_fields
+import response_format
+from response_format import columnar, negotiated_format, wants_columnar
+from pymongo import ReturnDocument
+from functools import wraps
+from pymongo.errors import BulkWriteError
+import click
+
+# Rutas de la API; la app se arma en create_app() (ver al final del archivo)
+bp = Blueprint("api", __name__, cli_group=None)
+
+
+@bp.app_errorhandler(PoolTimeout)
+def pool_timeout(e):
+    return jsonify({"error": "Servicio saturado, intenta nuevamente"}), 503
+
+
+@bp.app_errorhandler(HashingBusy)
+def hashing_busy(e):
+    resp = jsonify({"error": "Demasiadas solicitudes, intenta nuevamente"})
+    resp.headers["Retry-After"] = str(e.retry_after)
+    return resp, 429
+
+
+@bp.app_errorhandler(RateLimited)
+def rate_limited(e):
+    resp = jsonify({"error": "Demasiados intentos, espera antes de reintentar"})
+    resp.headers["Retry-After"] = str(e.retry_after)
+    return resp, 429
+
+
+@bp.get("/api/health")
 def health():
     return {"ok": True}
 
-@app.route("/api/auth/register", methods=["POST"])
+
+def _internal_only(view):
+    """Exige el header X-Internal-Token igual a INTERNAL_TOKEN; sin token
+    configurado los endpoints internos quedan cerrados (nginx expone /api/)."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        token = os.getenv("INTERNAL_TOKEN")
+        if not token:
+            return jsonify({"error": "INTERNAL_TOKEN no configurado"}), 403
+        if not hmac.compare_digest(request.headers.get("X-Internal-Token", ""), token):
+            return jsonify({"error": "no autorizado"}), 403
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def _flatten(prefix, d, out):
+    for k, v in d.items():
+        if isinstance(v, dict):
+            _flatten(f"{prefix}_{k}", v, out)
+        else:
+            out[f"{prefix}_{k}"] = v
+    return out
+
+
+@bp.get("/api/internal/metrics")
+@_internal_only
+def internal_metrics():
+    """Scrape de Prometheus: histogramas por ruta/componente + contadores."""
+    gauges = {}
+    _flatten("pg_pool", pg_pool.stats(), gauges)
+    _flatten("hashing", hasher.stats(), gauges)
+    _flatten("cache", response_cache.stats(), gauges)
+    _flatten("ratelimit", rate_limiter.stats(), gauges)
+    _flatten("write_behind", write_buffer.stats(), gauges)
+    _flatten("views", global_views.stats(), gauges)
+    return Response(instrumentation.render_prometheus(gauges),
+                    mimetype="text/plain; version=0.0.4")
+
+
+@bp.get("/api/internal/stats")
+@_internal_only
+def internal_stats():
+    return {"pg_pool": pg_pool.stats(), "hashing": hasher.stats(),
+            "outbox": outbox.stats(), "cache": response_cache.stats(),
+            "ratelimit": rate_limiter.stats(), "write_behind": write_buffer.stats(),
+            "views": global_views.stats(),
+            "startup": current_app.extensions.get("startup")}
+
+
+@bp.cli.command("outbox-drain")
+def outbox_drain():
+    """Envía de forma síncrona los correos pendientes del outbox."""
+    print(f"{outbox.drain()} correos enviados")
+
+@bp.route("/api/auth/register", methods=["POST"])
+@rate_limiter.limit("register", admission=True)
 def register():
     data = request.get_json()
     email = data.get("email", "").strip().lower()
@@ -79,34 +129,46 @@ def register():
     if len(password) > 72:
         password = password[:72]
 
-    ph = bcrypt.hash(password)  # hash seguro
+    ph = hasher.hash(password)  # hash seguro
 
     try:
-        with pg.cursor() as cur:
+        with pg_pool.cursor() as cur:
             cur.execute(
                 "INSERT INTO users(email,password_hash) VALUES (%s,%s) RETURNING id;",
                 (email, ph)
             )
             uid = cur.fetchone()["id"]
         return {"id": uid, "email": email}, 201
-    except Exception as e:
+    except UniqueViolation:
         return jsonify({"error": "Email ya registrado"}), 409
 
 
 
-@app.post("/api/auth/login")
+@bp.post("/api/auth/login")
+@rate_limiter.limit("login", admission=True)
 def login():
     data = request.get_json()
     email = data.get("email", "").strip().lower()
     password = data.get("password", "")
 
-    with pg.cursor() as cur:
+    with pg_pool.cursor() as cur:
         cur.execute("SELECT * FROM users WHERE email=%s;", (email,))
         user = cur.fetchone()
 
-    if not user or not bcrypt.verify(password, user["password_hash"]):
+    if not user or not hasher.verify(password, user["password_hash"]):
         return jsonify({"error": "credenciales inválidas"}), 401
 
+    # Rehash transparente si cambió el costo configurado (BCRYPT_ROUNDS)
+    if hasher.needs_rehash(user["password_hash"]):
+        try:
+            ph = hasher.hash(password)
+        except HashingBusy:
+            ph = None  # se reintenta en el próximo login
+        if ph:
+            with pg_pool.cursor() as cur:
+                cur.execute("UPDATE users SET password_hash=%s WHERE id=%s;", (ph, user["id"]))
+            hasher.mark_rehashed()
+
     # ✅ Fix: identity debe ser string, claims adicionales para email
     token = create_access_token(
         identity=str(user["id"]),
@@ -116,36 +178,44 @@ def login():
     return {"access_token": token}
 
 
-@app.get("/api/dashboard/metrics")
+@bp.get("/api/dashboard/metrics")
 @jwt_required()
+@response_cache.cached("dashboard-metrics", lambda: "global",
+                       ttl=int(os.getenv("VIEWS_REFRESH_INTERVAL", 60)),
+                       version_fn=global_views.version)
 def get_metrics():
-    out = list(metrics.find({}, {"_id": 0}))
-    return {"metrics": out}
-
-@app.post("/api/auth/forgot-password")
+    # Vista materializada (un doc); antes del primer refresco, el seed estático
+    view = global_views.dashboard()
+    if view is None:
+        return {"metrics": list(metrics.find({}, {"_id": 0})), "top_streaks": []}
+    return {"metrics": view["metrics"], "top_streaks": view.get("top_streaks", [])}
+
+@bp.post("/api/auth/forgot-password")
+@rate_limiter.limit("forgot")
 def forgot_password():
     data = request.get_json()
     email = data.get("email","").strip().lower()
 
     # Verificar si existe el usuario
-    with pg.cursor() as cur:
+    with pg_pool.cursor() as cur:
         cur.execute("SELECT id FROM users WHERE email=%s;", (email,))
         user = cur.fetchone()
     if not user:
         return jsonify({"error": "email no registrado"}), 404
 
-    token = s.dumps(email)  # firmamos el email
+    token = serializer().dumps(email)  # firmamos el email
     reset_link = f"http://localhost:5173/reset-password?token={token}"  # frontend
 
-    # Enviar correo a MailHog
-    msg = Message("Recupera tu contraseña", recipients=[email])
-    msg.body = f"Hola!\n\nHaz clic para cambiar tu contraseña:\n{reset_link}\n\nSi no pediste esto, ignora este mensaje."
-    mail.send(msg)
+    # Encolar correo (lo envía el outbox hacia MailHog)
+    outbox.enqueue(
+        "Recupera tu contraseña", [email],
+        f"Hola!\n\nHaz clic para cambiar tu contraseña:\n{reset_link}\n\nSi no pediste esto, ignora este mensaje."
+    )
 
     return {"message": "Correo enviado correctamente"}
 
 
-@app.post("/api/auth/reset-password")
+@bp.post("/api/auth/reset-password")
 def reset_password():
     token = request.args.get("token","")
     data = request.get_json()
@@ -155,27 +225,25 @@ def reset_password():
         return jsonify({"error":"contraseña requerida"}), 400
 
     try:
-        email = s.loads(token, max_age=3600)
+        email = serializer().loads(token, max_age=3600)
     except SignatureExpired:
         return jsonify({"error":"token expirado"}), 400
     except BadSignature:
         return jsonify({"error":"token inválido"}), 400
 
-    ph = bcrypt.hash(newpass)
+    ph = hasher.hash(newpass)
 
-    with pg.cursor() as cur:
+    with pg_pool.cursor() as cur:
         cur.execute("UPDATE users SET password_hash=%s WHERE email=%s;", (ph, email))
 
-    # Enviar correo de confirmación
-    msg = Message(
-        "Confirmación de cambio de contraseña",
-        recipients=[email]
-    )
-    msg.body = (
-        f"Hola!\n\nTu contraseña ha sido cambiada correctamente.\n"
-        "Si no realizaste este cambio, por favor contacta con soporte inmediatamente."
+    # Encolar correo de confirmación
+    outbox.enqueue(
+        "Confirmación de cambio de contraseña", [email],
+        (
+            f"Hola!\n\nTu contraseña ha sido cambiada correctamente.\n"
+            "Si no realizaste este cambio, por favor contacta con soporte inmediatamente."
+        )
     )
-    mail.send(msg)
 
     return {"ok": True, "message": "Contraseña cambiada y correo de confirmación enviado"}
 
@@ -184,13 +252,27 @@ def reset_password():
 from datetime import datetime, date
 from bson import ObjectId
 from flask_jwt_extended import jwt_required, get_jwt
-from flask import jsonify, request, current_app 
-# Colección (log de entrenamientos)
-metrics_log = mdb.metrics_log
-
-# Índices útiles
-metrics_log.create_index([("user_id", 1), ("date", 1)])
-metrics_log.create_index([("year", 1), ("month", 1)])
+from flask import jsonify, request, current_app, Response, stream_with_context
+import base64
+import csv
+import io
+import json
+import math
+# Colección (log de entrenamientos): extensions.metrics_log
+
+# Solo los campos del item, con la fecha formateada por Mongo
+METRIC_ITEM_PROJECTION = ITEM_PROJECTION
+METRIC_ITEM_FIELDS = ("_id", "type", "hours", "date")
+SUMMARY_FIELDS = ("type", "hours")
+# Campos que necesitan los rollups para mover horas entre buckets
+ROLLUP_PROJECTION = {"user_id": 1, "type": 1, "hours": 1, "year": 1, "month": 1, "week": 1}
+METRICS_PAGE_MAX = 500
+BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", 500))
+BULK_MAX_ERRORS = 1000
+DASHBOARD_RECENT = int(os.getenv("DASHBOARD_RECENT", 20))
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", 2000))
+EXPORT_FLUSH_BYTES = 64 * 1024
+EXPORT_MIMETYPES = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
 
 
 # ----------------------------- Helpers ----------------------------------------
@@ -211,149 +293,348 @@ def _get_user_from_jwt():
                 sub.get("email"))
     return (str(sub) if sub is not None else None, claims.get("email"))
 
-def _safe_item_from_doc(d):
-    """Convierte un doc de Mongo a item serializable; omite docs viejos/malformados."""
+def _item_from_doc(d):
+    """Doc ya proyectado por METRIC_ITEM_PROJECTION → item de la API.
+    El esquema lo garantiza el validador de metrics_log (ver metrics_schema.py)."""
+    d["_id"] = str(d["_id"])
+    return d
+
+def _metric_fields_from_payload(data, default_today=True):
+    """Valida type/hours/date de un payload y devuelve los campos canónicos.
+    Lanza ValueError con el mensaje para el cliente."""
+    if not isinstance(data, dict):
+        raise ValueError("Cada entrenamiento debe ser un objeto JSON")
+    m_type = str(data.get("type", "")).strip().capitalize()  # Cardio/Fuerza
+    hours  = data.get("hours", None)
+    date_str = str(data.get("date") or "").strip()
+
+    if m_type not in METRIC_TYPES:
+        raise ValueError("El tipo debe ser 'Cardio' o 'Fuerza'")
+
+    # Igual que metrics_schema.repair: NaN/inf pasan float() y el validador,
+    # pero rompen los rollups y el JSON de salida
     try:
-        _id = d.get("_id")
-        if not _id:
-            return None
-        _id = str(_id)
-
-        mtype = d.get("type")
-        if not isinstance(mtype, str) or not mtype.strip():
-            current_app.logger.warning("Doc sin 'type', omitido: %s", d)
-            return None
-        mtype = mtype.strip().capitalize()  # Cardio/Fuerza
-
-        # hours → float
-        try:
-            hours = float(d.get("hours", 0))
-        except Exception:
-            current_app.logger.warning("Doc con 'hours' inválido, omitido: %s", d)
-            return None
-
-        # date → "YYYY-MM-DD"
-        date_raw = d.get("date")
-        if isinstance(date_raw, datetime):
-            date_str = date_raw.strftime("%Y-%m-%d")
-        elif isinstance(date_raw, str):
-            try:
-                if len(date_raw) == 10 and date_raw[4] == "-" and date_raw[7] == "-":
-                    date_str = date_raw
-                else:
-                    dt = datetime.fromisoformat(date_raw.replace("Z", "+00:00"))
-                    date_str = dt.strftime("%Y-%m-%d")
-            except Exception:
-                current_app.logger.warning("Doc con 'date' inválido, omitido: %s", d)
-                return None
-        else:
-            current_app.logger.warning("Doc sin 'date' usable, omitido: %s", d)
-            return None
+        if isinstance(hours, bool):
+            raise ValueError
+        hours = float(hours)
+        if not math.isfinite(hours):
+            raise ValueError
+    except (TypeError, ValueError):
+        raise ValueError("Horas debe ser numérico")
 
-        return {"_id": _id, "type": mtype, "hours": hours, "date": date_str}
-    except Exception as e:
-        current_app.logger.exception("Fallo serializando doc de métricas: %s", e)
-        return None
+    if not date_str and default_today:
+        dt = datetime.combine(date.today(), datetime.min.time())
+    else:
+        dt = _parse_yyyy_mm_dd(date_str)
+    return metric_fields(m_type, hours, dt)
+
+def _metric_doc_from_payload(data, user_id, email):
+    """Valida un payload de entrenamiento y arma el doc de metrics_log.
+    Lanza ValueError con el mensaje para el cliente."""
+    fields = _metric_fields_from_payload(data)
+    return {
+        "user_id": user_id,
+        "email": email,
+        **fields,
+        "created_at": datetime.utcnow(),
+    }
+
+def _iter_bulk_rows():
+    """Filas del cuerpo: NDJSON (una por línea, leída en streaming) o un array JSON.
+    Entrega (índice, payload|None, error|None)."""
+    if request.mimetype in ("application/x-ndjson", "application/ndjson"):
+        for i, line in enumerate(request.stream):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield i, json.loads(line), None
+            except ValueError:
+                yield i, None, "JSON inválido"
+        return
+    data = request.get_json(silent=True)
+    if isinstance(data, dict):
+        data = data.get("items")
+    if not isinstance(data, list):
+        raise ValueError("Se espera un array JSON o NDJSON")
+    for i, row in enumerate(data):
+        yield i, row, None
+
+def _encode_cursor(item):
+    """Token opaco de continuación a partir del último item de la página."""
+    key = {"i": str(item["_id"]), "d": item["date"]}
+    raw = json.dumps(key, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def _decode_cursor(token: str):
+    """Devuelve (date, ObjectId) o lanza ValueError si el token no es válido."""
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        key = json.loads(raw)
+        return _parse_yyyy_mm_dd(key["d"]), ObjectId(key["i"])
+    except Exception:
+        raise ValueError("cursor inválido")
+
+def _metrics_page_query(user_id, cursor_token):
+    q = {"user_id": user_id}
+    if cursor_token:
+        d, oid = _decode_cursor(cursor_token)
+        q["$or"] = [{"date": {"$lt": d}}, {"date": d, "_id": {"$lt": oid}}]
+    return q
+
+def _stream_items(cur, limit):
+    """Emite {"items": [...], "next_cursor": ...} a medida que Mongo entrega docs."""
+    yield '{"items":['
+    sep, last, n = "", None, 0
+    for d in cur:
+        n += 1
+        last = _item_from_doc(d)
+        yield sep + json.dumps(last, ensure_ascii=False)
+        sep = ","
+    next_cursor = _encode_cursor(last) if limit and n == limit else None
+    yield '],"next_cursor":' + json.dumps(next_cursor) + "}"
+
+def _export_chunks(cur, fmt):
+    """CSV o NDJSON desde el cursor, en bloques de ~EXPORT_FLUSH_BYTES.
+    La memoria queda acotada por el batch de Mongo y el bloque en curso."""
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator="\n") if fmt == "csv" else None
+    try:
+        if writer:
+            writer.writerow(METRIC_ITEM_FIELDS)
+        for d in cur:
+            if writer:
+                writer.writerow((str(d["_id"]), d["type"], d["hours"], d["date"]))
+            else:
+                buf.write(json.dumps(_item_from_doc(d), ensure_ascii=False))
+                buf.write("\n")
+            if buf.tell() >= EXPORT_FLUSH_BYTES:
+                yield buf.getvalue()
+                buf.seek(0)
+                buf.truncate()
+        if buf.tell():
+            yield buf.getvalue()
+    finally:
+        cur.close()  # libera el cursor del servidor si el cliente corta
 
 # ----------------------------- Endpoints --------------------------------------
 
-@app.post("/api/metrics")
+@bp.post("/api/metrics")
 @jwt_required()
 def add_metric():
     user_id, email = _get_user_from_jwt()
     if not user_id:
         return jsonify({"error": "No se pudo identificar al usuario"}), 401
 
-    data = request.get_json() or {}
-    m_type = str(data.get("type", "")).strip().capitalize()  # Cardio/Fuerza
-    hours  = data.get("hours", None)
-    date_str = (data.get("date") or "").strip()
-
-    if m_type not in ["Cardio", "Fuerza"]:
-        return jsonify({"error": "El tipo debe ser 'Cardio' o 'Fuerza'"}), 400
-
-    try:
-        hours = float(hours)
-    except Exception:
-        return jsonify({"error": "Horas debe ser numérico"}), 400
-
-    if not date_str:
-        dt = datetime.combine(date.today(), datetime.min.time())
-    else:
+    # Write-behind en modo flush: el lote sale cuando encolan todas las en curso
+    # (el encolado va dentro de incoming(); sin write-behind no hace nada)
+    with write_buffer.incoming():
+        data = request.get_json() or {}
         try:
-            dt = _parse_yyyy_mm_dd(date_str)
+            doc = _metric_doc_from_payload(data, user_id, email)
         except ValueError as e:
             return jsonify({"error": str(e)}), 400
+        ticket = write_buffer.enqueue(doc) if write_buffer.enabled else None
+
+    if ticket is not None:
+        # Rollups e invalidación de caché ocurren al vaciar el lote
+        if write_buffer.durability == "flush":
+            written = ticket.wait(write_buffer.ack_timeout)
+            if written is False:
+                return jsonify({"error": "No se pudo guardar el entrenamiento"}), 500
+            if written:
+                return {"ok": True, "message": "Entrenamiento registrado",
+                        "_id": str(doc["_id"])}, 201
+        return {"ok": True, "message": "Entrenamiento en cola",
+                "_id": str(doc["_id"])}, 202
+    # Sin write-behind o con el buffer lleno: escritura directa
 
-    doc = {
-        "user_id": user_id,
-        "email": email,
-        "type": m_type,
-        "hours": hours,
-        "date": dt,
-        "year": dt.year,
-        "month": dt.month,
-        "week": dt.isocalendar().week,
-        "created_at": datetime.utcnow(),
-    }
     metrics_log.insert_one(doc)
-    return {"ok": True, "message": "Entrenamiento registrado"}, 201
+    rollups.add(doc)
+    response_cache.invalidate(user_id)
+    return {"ok": True, "message": "Entrenamiento registrado", "_id": str(doc["_id"])}, 201
 
 
-@app.get("/api/metrics")
+@bp.post("/api/metrics/bulk")
+@jwt_required()
+def add_metrics_bulk():
+    """Ingesta masiva: array JSON o NDJSON; errores por fila sin abortar el lote."""
+    user_id, email = _get_user_from_jwt()
+    if not user_id:
+        return jsonify({"error": "No se pudo identificar al usuario"}), 401
+
+    inserted, duplicates, errors = 0, 0, []
+
+    def add_error(row, msg):
+        if len(errors) < BULK_MAX_ERRORS:
+            errors.append({"row": row, "error": msg})
+
+    def flush(chunk):
+        nonlocal inserted, duplicates
+        if not chunk:
+            return
+        docs = [d for _, d in chunk]
+        failed = set()
+        try:
+            metrics_log.insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            for we in e.details.get("writeErrors", []):
+                failed.add(we["index"])
+                row = chunk[we["index"]][0]
+                if we.get("code") == 11000:
+                    duplicates += 1
+                else:
+                    add_error(row, "No se pudo guardar")
+        ok = [d for i, d in enumerate(docs) if i not in failed]
+        inserted += len(ok)
+        rollups.add_many(ok)
+
+    chunk = []
+    try:
+        for row, payload, err in _iter_bulk_rows():
+            if err:
+                add_error(row, err)
+                continue
+            try:
+                doc = _metric_doc_from_payload(payload, user_id, email)
+            except ValueError as e:
+                add_error(row, str(e))
+                continue
+            key = payload.get("idempotency_key")
+            if key is not None:
+                doc["idempotency_key"] = str(key)
+            chunk.append((row, doc))
+            if len(chunk) >= BULK_CHUNK_SIZE:
+                flush(chunk)
+                chunk = []
+        flush(chunk)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    finally:
+        if inserted:
+            response_cache.invalidate(user_id)
+
+    return {"inserted": inserted, "duplicates": duplicates, "errors": errors}
+
+
+@bp.get("/api/metrics")
 @jwt_required()
 def list_metrics():
     user_id, _ = _get_user_from_jwt()
     if not user_id:
         return jsonify({"items": []})
 
+    # ?limit=N&cursor=<token> → paginación keyset; sin limit devuelve todo
+    # ?stream=1 → respuesta emitida a medida que avanza el cursor de Mongo
+    # ?format=columnar → arreglos por campo (no se emite en streaming)
+    cursor_token = request.args.get("cursor") or None
+    limit = request.args.get("limit")
+    as_columnar = wants_columnar()
+    stream = request.args.get("stream") in ("1", "true") and not as_columnar
+    try:
+        limit = max(1, min(int(limit), METRICS_PAGE_MAX)) if limit else None
+    except ValueError:
+        return jsonify({"error": "limit inválido"}), 400
+    if cursor_token and not limit:
+        limit = METRICS_PAGE_MAX
+    try:
+        query = _metrics_page_query(user_id, cursor_token)
+    except ValueError:
+        return jsonify({"error": "cursor inválido"}), 400
+
+    cur = (metrics_log.find(query, METRIC_ITEM_PROJECTION)
+           .sort([("date", -1), ("_id", -1)]))
+    if limit:
+        cur = cur.limit(limit)
+
+    if stream:
+        return Response(stream_with_context(_stream_items(cur, limit)),
+                        mimetype="application/json")
+
+    out = [_item_from_doc(d) for d in cur]
+    if as_columnar:
+        resp = columnar(out, METRIC_ITEM_FIELDS, encoded=("type",))
+    else:
+        resp = {"items": out}
+    if limit:
+        resp["next_cursor"] = _encode_cursor(out[-1]) if len(out) == limit else None
+    return resp
 
-    cur = metrics_log.find({"user_id": user_id}).sort([("date", -1)])
 
-    out = []
-    for d in cur:
-        item = _safe_item_from_doc(d)
-        if item:
-            out.append(item)
-    return {"items": out}
+@bp.get("/api/metrics/export")
+@jwt_required()
+def export_metrics():
+    """Historial completo en CSV (?format=csv, por defecto) o NDJSON, del más
+    antiguo al más reciente. Filtros opcionales ?from=YYYY-MM-DD&to=YYYY-MM-DD."""
+    user_id, _ = _get_user_from_jwt()
+    if not user_id:
+        return jsonify({"error": "No se pudo identificar al usuario"}), 401
+
+    fmt = request.args.get("format", "csv")
+    if fmt not in EXPORT_MIMETYPES:
+        return jsonify({"error": "format debe ser 'csv' o 'ndjson'"}), 400
+    query = {"user_id": user_id}
+    try:
+        date_range = {}
+        if request.args.get("from"):
+            date_range["$gte"] = _parse_yyyy_mm_dd(request.args["from"])
+        if request.args.get("to"):
+            date_range["$lte"] = _parse_yyyy_mm_dd(request.args["to"])
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if date_range:
+        query["date"] = date_range
+
+    cur = (metrics_log.find(query, METRIC_ITEM_PROJECTION)
+           .sort([("date", 1), ("_id", 1)])
+           .batch_size(EXPORT_BATCH_SIZE))
+    filename = f"entrenamientos-{date.today().isoformat()}.{fmt}"
+    return Response(
+        stream_with_context(_export_chunks(cur, fmt)),
+        mimetype=EXPORT_MIMETYPES[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"',
+                 "Cache-Control": "no-store"},
+    )
 
 
-@app.get("/api/metrics/summary-current-month")
+@bp.get("/api/metrics/summary-current-month")
 @jwt_required()
+@response_cache.cached("summary-current-month", lambda: _get_user_from_jwt()[0],
+                       vary_fn=negotiated_format)
 def summary_current_month():
     user_id, _ = _get_user_from_jwt()
     if not user_id:
         return jsonify({"month": {"year": 0, "month": 0, "summary": []},
                         "week":  {"year": 0, "week": 0, "summary": []}})
 
-    today = date.today()
-    y, m = today.year, today.month
-    current_week = today.isocalendar().week
-
-    monthly_pipeline = [
-        {"$match": {"user_id": user_id, "year": y, "month": m}},
-        {"$group": {"_id": "$type", "total_hours": {"$sum": "$hours"}}},
-        {"$sort": {"_id": 1}},
-    ]
-    weekly_pipeline = [
-        {"$match": {"user_id": user_id, "year": y, "week": current_week}},
-        {"$group": {"_id": "$type", "total_hours": {"$sum": "$hours"}}},
-        {"$sort": {"_id": 1}},
-    ]
-
-    monthly = list(metrics_log.aggregate(monthly_pipeline))
-    weekly  = list(metrics_log.aggregate(weekly_pipeline))
-
-    out_monthly = [{"type": r["_id"], "hours": r["total_hours"]} for r in monthly]
-    out_weekly  = [{"type": r["_id"], "hours": r["total_hours"]} for r in weekly]
+    y, m, current_week = _current_period()
+    # Lectura de rollups precalculados (un doc por tipo)
+    return _current_summaries(y, m, current_week, rollups.month_summary(user_id, y, m),
+                              rollups.week_summary(user_id, y, current_week),
+                              as_columnar=wants_columnar())
 
+
+def _current_period():
+    today = date.today()
+    return today.year, today.month, today.isocalendar().week
+
+
+def _current_summaries(y, m, current_week, out_monthly, out_weekly, as_columnar=False):
+    if as_columnar:
+        return {
+            "format": "columnar",
+            "month": {"year": y, "month": m,
+                      "summary": columnar(out_monthly, SUMMARY_FIELDS, encoded=("type",))},
+            "week":  {"year": y, "week": current_week,
+                      "summary": columnar(out_weekly, SUMMARY_FIELDS, encoded=("type",))},
+        }
     return {
         "month": {"year": y, "month": m, "summary": out_monthly},
         "week":  {"year": y, "week": current_week, "summary": out_weekly},
     }
 
 
-@app.put("/api/metrics/<metric_id>")
+@bp.put("/api/metrics/<metric_id>")
 @jwt_required()
 def update_metric(metric_id):
     user_id, _ = _get_user_from_jwt()
@@ -361,55 +642,50 @@ def update_metric(metric_id):
         return jsonify({"error": "No se pudo identificar al usuario"}), 401
 
     data = request.get_json() or {}
-    mtype    = str(data.get("type", "")).strip().capitalize()
-    hours_in = data.get("hours", None)
-    date_str = (data.get("date") or "").strip()
-
-    if mtype not in ["Cardio", "Fuerza"]:
-        return jsonify({"error": "El tipo debe ser 'Cardio' o 'Fuerza'"}), 400
     try:
-        hours = float(hours_in)
-    except Exception:
-        return jsonify({"error": "Horas debe ser numérico"}), 400
-    try:
-        dt = _parse_yyyy_mm_dd(date_str)
-    except Exception:
-        return jsonify({"error": "fecha inválida (YYYY-MM-DD)"}), 400
+        fields = _metric_fields_from_payload(data, default_today=False)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
-    res = metrics_log.update_one(
+    old = metrics_log.find_one_and_update(
         {"_id": ObjectId(metric_id), "user_id": user_id},
-        {"$set": {
-            "type": mtype,
-            "hours": hours,
-            "date": dt,
-            "year": dt.year,
-            "month": dt.month,
-            "week": dt.isocalendar().week,
-        }}
+        {"$set": {**fields, "updated_at": datetime.utcnow()}},
+        projection=ROLLUP_PROJECTION,
+        return_document=ReturnDocument.BEFORE,
     )
-    if res.matched_count == 0:
+    if old is None:
         return jsonify({"error": "Métrica no encontrada"}), 404
+    rollups.move(old, {"user_id": user_id, **fields})
+    response_cache.invalidate(user_id)
     return {"ok": True}
 
 
-@app.delete("/api/metrics/<metric_id>")
+@bp.delete("/api/metrics/<metric_id>")
 @jwt_required()
 def delete_metric(metric_id):
     user_id, _ = _get_user_from_jwt()
     if not user_id:
         return jsonify({"error": "No se pudo identificar al usuario"}), 401
 
-    res = metrics_log.delete_one({"_id": ObjectId(metric_id), "user_id": user_id})
-    if res.deleted_count == 0:
+    old = metrics_log.find_one_and_delete(
+        {"_id": ObjectId(metric_id), "user_id": user_id},
+        projection=ROLLUP_PROJECTION,
+    )
+    if old is None:
         return jsonify({"error": "Métrica no encontrada"}), 404
+    rollups.remove(old)
+    global_views.record_delete(user_id)
+    response_cache.invalidate(user_id)
     return {"ok": True}
 
 from datetime import datetime, date
 from flask_jwt_extended import jwt_required
 from flask import request, jsonify
 
-@app.get("/api/metrics/summary-by-month")
+@bp.get("/api/metrics/summary-by-month")
 @jwt_required()
+@response_cache.cached("summary-by-month", lambda: _get_user_from_jwt()[0],
+                       vary_fn=negotiated_format)
 def summary_by_month():
     """Totales por mes (últimos N meses) separados por tipo (solo docs válidos)."""
     user_id, _ = _get_user_from_jwt()
@@ -422,45 +698,175 @@ def summary_by_month():
         limit = 6
     limit = max(1, min(limit, 24))
 
-    # Filtra SOLO documentos con schema correcto: type y hours presentes
-    pipeline = [
-        {"$match": {
-            "user_id": user_id,
-            "type": {"$exists": True, "$ne": None},
-            "hours": {"$exists": True}
-        }},
-        {"$group": {
-            "_id": {"year": "$year", "month": "$month", "type": "$type"},
-            "total_hours": {"$sum": "$hours"}
-        }},
-        {"$group": {
-            "_id": {"year": "$_id.year", "month": "$_id.month"},
-            "by_type": {"$push": {"type": "$_id.type", "hours": "$total_hours"}}
-        }},
-        {"$sort": {"_id.year": -1, "_id.month": -1}},
-        {"$limit": limit}
-    ]
-
-    rows = list(metrics_log.aggregate(pipeline))
-
-    out = []
-    for r in rows:
-        y = r["_id"]["year"]
-        m = r["_id"]["month"]
-        entry = {"year": y, "month": m, "summary": []}
-        for t in r.get("by_type", []):
-            # Tolerante por si algún doc trae type nulo o raro
-            t_type = t.get("type") or "Desconocido"
-            try:
-                t_hours = float(t.get("hours", 0))
-            except Exception:
-                t_hours = 0.0
-            entry["summary"].append({"type": t_type, "hours": t_hours})
-        out.append(entry)
-
+    # Rollups mensuales: solo cuentan docs con type y hours válidos
+    out = rollups.by_month(user_id, limit)
+    if wants_columnar():
+        # Una fila por mes × tipo, lista para graficar sin re-pivotear
+        rows = ({"year": mo["year"], "month": mo["month"], **r}
+                for mo in out for r in mo["summary"])
+        return columnar(rows, ("year", "month") + SUMMARY_FIELDS, encoded=("type",))
     return {"months": out}
 
 
+def _recent_items(user_id, limit):
+    """Primera página de GET /api/metrics?limit=N."""
+    cur = (metrics_log.find({"user_id": user_id}, METRIC_ITEM_PROJECTION)
+           .sort([("date", -1), ("_id", -1)]).limit(limit))
+    items = [_item_from_doc(d) for d in cur]
+    return {"items": items,
+            "next_cursor": _encode_cursor(items[-1]) if len(items) == limit else None}
+
+
+@bp.get("/api/dashboard")
+@jwt_required()
+@response_cache.cached("dashboard", lambda: _get_user_from_jwt()[0])
+def dashboard():
+    """Todo lo que pinta el dashboard en una respuesta: resúmenes mes/semana,
+    últimos N meses (?months=6) y los entrenamientos recientes (?recent=20,
+    con next_cursor para seguir paginando en /api/metrics)."""
+    user_id, _ = _get_user_from_jwt()
+    if not user_id:
+        return jsonify({"error": "No se pudo identificar al usuario"}), 401
+    try:
+        months = max(1, min(int(request.args.get("months", 6)), 24))
+        recent = max(1, min(int(request.args.get("recent", DASHBOARD_RECENT)), METRICS_PAGE_MAX))
+    except ValueError:
+        return jsonify({"error": "months/recent inválidos"}), 400
+
+    # Consultas independientes: se lanzan en paralelo y se espera la más lenta
+    y, m, current_week = _current_period()
+    futures = {
+        "month": dashboard_executor.submit(rollups.month_summary, user_id, y, m),
+        "week": dashboard_executor.submit(rollups.week_summary, user_id, y, current_week),
+        "months": dashboard_executor.submit(rollups.by_month, user_id, months),
+        "recent": dashboard_executor.submit(_recent_items, user_id, recent),
+    }
+    res = {k: f.result() for k, f in futures.items()}
+    return {
+        **_current_summaries(y, m, current_week, res["month"], res["week"]),
+        "months": res["months"],
+        "recent": res["recent"],
+    }
+
+
+@bp.cli.command("rollups-rebuild")
+@click.option("--user", "user_id", default=None, help="Solo este user_id")
+def rollups_rebuild(user_id):
+    """Reconstruye metrics_rollup desde metrics_log."""
+    print(f"{rollups.rebuild(user_id)} documentos de rollup generados")
+
+
+@bp.cli.command("rollups-verify")
+@click.option("--user", "user_id", default=None, help="Solo este user_id")
+def rollups_verify(user_id):
+    """Compara metrics_rollup con metrics_log; sale con código 1 si difieren."""
+    diffs = rollups.verify(user_id)
+    for d in diffs[:50]:
+        print(d)
+    print(f"{len(diffs)} diferencias")
+    if diffs:
+        raise SystemExit(1)
+
+
+@bp.cli.command("views-refresh")
+@click.option("--full", is_flag=True, help="Recalcular todos los usuarios")
+def views_refresh(full):
+    """Refresca las vistas globales del dashboard (incremental por defecto)."""
+    n = global_views.refresh(full=full)
+    print("otro proceso está refrescando" if n is None else f"{n} usuarios recalculados")
+
+
+@bp.cli.command("indexes-verify")
+@click.option("--users", default=50, help="Usuarios sintéticos")
+@click.option("--sessions", default=500, help="Sesiones por usuario")
+@click.option("--keep", is_flag=True, help="No borrar la base de verificación")
+def indexes_verify(users, sessions, keep):
+    """explain() de cada forma de consulta sobre datos sembrados; código 1 si algún plan se degrada."""
+    scratch = mongo[mdb.name + "_explain"]
+    mongo.drop_database(scratch.name)
+    try:
+        indexes.ensure_indexes(scratch)
+        rollup_store = RollupStore(scratch.metrics_rollup, scratch.metrics_log)
+        sample = indexes.seed(scratch, users, sessions, rollups=rollup_store,
+                              views=GlobalViews(scratch, scratch.metrics_log,
+                                                rollup_store.col))
+        results = indexes.verify_plans(scratch, sample)
+    finally:
+        if not keep:
+            mongo.drop_database(scratch.name)
+    failed = [r for r in results if r["problems"]]
+    for r in results:
+        status = "FALLA" if r["problems"] else "ok"
+        print(f"{status:5} {r['shape']:22} {'/'.join(r['stages']):40} "
+              f"keys={r['keys_examined']} docs={r['docs_examined']} "
+              f"n={r['n_returned']} {'; '.join(r['problems'])}")
+    if failed:
+        raise SystemExit(1)
+
+
+def create_app():
+    """Application factory. Los clientes de BD, el pool de bcrypt y el sender
+    del outbox se crean perezosamente en cada worker, después del fork."""
+    t0 = time.perf_counter()
+    app = Flask(__name__)
+    CORS(app)
+
+    app.config["MAIL_SERVER"] = os.getenv("MAIL_HOST", "mailhog")
+    app.config["MAIL_PORT"] = int(os.getenv("MAIL_PORT", 1025))
+    app.config["MAIL_USE_TLS"] = False
+    app.config["MAIL_USE_SSL"] = False
+    app.config["MAIL_DEFAULT_SENDER"] = "noreply@miapp.com"
+    mail.init_app(app)
+
+    # Config
+    app.config["JWT_SECRET_KEY"] = os.getenv("JWT_SECRET", "dev")
+    app.config["JWT_ACCESS_TOKEN_EXPIRES"] = timedelta(hours=6)
+    jwt.init_app(app)
+
+    outbox.init_app(app)
+    write_buffer.init_app(app)
+    global_views.init_app(app)
+    instrumentation.init_app(app)
+    response_format.init_app(app)
+    app.register_blueprint(bp)
+    t_ready = time.perf_counter()
+
+    # Sin DDL al arrancar: solo se valida la versión (ver migrations.py)
+    schema = None
+    check = os.getenv("SCHEMA_CHECK", "strict")
+    if check != "off":
+        try:
+            schema = migrations.check_schema()
+        except migrations.SchemaOutdated as e:
+            if check == "strict":
+                raise
+            app.logger.warning("%s", e)
+    t_done = time.perf_counter()
+
+    app.extensions["startup"] = {
+        "pid": os.getpid(),
+        "import_ms": round((t0 - _IMPORT_T0) * 1000, 1),
+        "create_app_ms": round((t_ready - t0) * 1000, 1),
+        "schema_check_ms": round((t_done - t_ready) * 1000, 1),
+        "total_ms": round((t_done - _IMPORT_T0) * 1000, 1),
+        "schema": schema,
+    }
+    app.logger.info("startup %s", app.extensions["startup"])
+    return app
+
+
+@bp.before_app_request
+def _start_background_workers():
+    # Primer request del worker: arranca el sender (drena lo pendiente de antes
+    # de un reinicio) y el refresco de vistas globales. Idempotente y fork-safe.
+    outbox.start()
+    global_views.start()
+
+
+atexit.register(extensions.shutdown)
+
+
 if __name__ == "__main__":
     # importante: host 0.0.0.0 para que sea accesible desde otros contenedores (nginx)
-    app.run(host="0.0.0.0", port=int(os.getenv("PORT", 5000)), debug=False)
+    create_app().run(host="0.0.0.0", port=int(os.getenv("PORT", 5000)), debug=False,
+                     threaded=True)
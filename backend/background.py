@@ -0,0 +1,83 @@
+"""Piezas comunes de los servicios con contadores y de los hilos de fondo.
+
+`Counters` da los contadores thread-safe que se ven en /api/internal/stats.
+`BackgroundWorker` es un hilo daemon por proceso (fork-safe: se recrea si el
+PID cambia) que llama a `run_once()` cada `interval` segundos o al despertarlo
+con `wake()`; lo usan el outbox, las vistas globales y el write-behind.
+"""
+import logging
+import os
+import threading
+
+
+class Counters:
+    """Mixin: contadores en `self._stats` protegidos por `self._stats_lock`."""
+
+    def _init_stats(self, **initial):
+        self._stats_lock = threading.Lock()
+        self._stats = dict(initial)
+
+    def _bump(self, **deltas):
+        with self._stats_lock:
+            for k, v in deltas.items():
+                self._stats[k] += v
+
+    def _snapshot(self):
+        with self._stats_lock:
+            return dict(self._stats)
+
+
+class BackgroundWorker(Counters):
+    thread_name = "background"
+    error_message = "Fallo en el hilo de fondo"
+
+    def __init__(self, app=None, interval=5.0):
+        self.app = app
+        self.interval = interval
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def logger(self):
+        return self.app.logger if self.app is not None else logging.getLogger(__name__)
+
+    def run_once(self):
+        raise NotImplementedError
+
+    def _after_fork(self):
+        """Descarta el estado heredado del proceso padre (antes del primer hilo)."""
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception:
+                self.logger.exception(self.error_message)
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def wake(self):
+        self._wake.set()
+
+    def start(self):
+        pid = os.getpid()
+        if self._thread is not None and self._pid == pid and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or self._pid != pid or not self._thread.is_alive():
+                if self._pid != pid:
+                    self._after_fork()
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name=self.thread_name,
+                                                daemon=True)
+                self._pid = pid
+                self._thread.start()
+
+    def stop(self, timeout=5.0):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join(timeout)
@@ -0,0 +1,352 @@
+"""Benchmark / prueba de carga de todos los endpoints de la API.
+
+Siembra Postgres y Mongo (los de DATABASE_URL / MONGODB_URI, p. ej. los
+contenedores de docker-compose) con usuarios × sesiones, ejecuta cada endpoint
+con concurrencia controlada y emite JSON con throughput y p50/p95/p99 por
+endpoint, comparable entre commits:
+
+    python bench.py --users 50 --sessions 500 --concurrency 16 --requests 400 \\
+        --base-url http://localhost/api --out bench.json
+    python bench.py --in-process ...             # Flask test client, sin HTTP
+    python bench.py ... --compare baseline.json  # código 1 si hay regresión
+"""
+import argparse
+import http.client
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from urllib.parse import urlsplit
+
+BENCH_DOMAIN = "bench.local"
+BENCH_PASSWORD = "bench-password"
+
+
+# ----------------------------- Clientes ---------------------------------------
+class HttpClient:
+    """HTTP/1.1 con keep-alive: una conexión por hilo."""
+
+    def __init__(self, base_url):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.prefix = parts.path.rstrip("/")
+        self._local = threading.local()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = http.client.HTTPConnection(self.host, self.port, timeout=30)
+        return conn
+
+    def request(self, method, path, body=None, token=None):
+        headers = {"Accept": "application/json"}
+        if body is not None:
+            body = json.dumps(body)
+            headers["Content-Type"] = "application/json"
+        if token:
+            headers["Authorization"] = f"Bearer {token}"
+        conn = self._conn()
+        try:
+            conn.request(method, self.prefix + path, body=body, headers=headers)
+            resp = conn.getresponse()
+            data = resp.read()
+        except (http.client.HTTPException, OSError):
+            conn.close()
+            self._local.conn = None
+            raise
+        if data and (resp.getheader("Content-Type") or "").startswith("application/json"):
+            return resp.status, json.loads(data)
+        return resp.status, data or None
+
+
+class InProcessClient:
+    """Flask test client sobre la app real (sin red ni gunicorn)."""
+
+    def __init__(self):
+        from app import create_app
+        self.app = create_app()
+        self.prefix = "/api"
+
+    def request(self, method, path, body=None, token=None):
+        headers = {"Authorization": f"Bearer {token}"} if token else {}
+        resp = self.app.test_client().open(self.prefix + path, method=method,
+                                           json=body, headers=headers)
+        return resp.status_code, resp.get_json(silent=True)
+
+
+# ----------------------------- Siembra ----------------------------------------
+def seed(users, sessions, rng):
+    """Crea usuarios bench y su historial directamente en las bases."""
+    from passlib.hash import bcrypt
+    from extensions import metrics_log, pg_pool, rollups
+
+    rounds = int(os.getenv("BCRYPT_ROUNDS", 12))
+    ph = bcrypt.using(rounds=rounds).hash(BENCH_PASSWORD)  # mismo hash para todos
+    emails = [f"user{i}@{BENCH_DOMAIN}" for i in range(users)]
+    with pg_pool.cursor() as cur:
+        cur.execute("DELETE FROM users WHERE email LIKE %s;", (f"%@{BENCH_DOMAIN}",))
+        cur.executemany("INSERT INTO users(email, password_hash) VALUES (%s, %s);",
+                        [(e, ph) for e in emails])
+        cur.execute("SELECT id, email FROM users WHERE email LIKE %s;", (f"%@{BENCH_DOMAIN}",))
+        ids = {r["email"]: str(r["id"]) for r in cur.fetchall()}
+
+    metrics_log.delete_many({"email": {"$regex": f"@{BENCH_DOMAIN}$"}})
+    today = datetime.combine(date.today(), datetime.min.time())
+    batch = []
+    for e in emails:
+        for _ in range(sessions):
+            dt = today - timedelta(days=rng.randrange(0, 3 * 365))
+            batch.append({
+                "user_id": ids[e], "email": e,
+                "type": rng.choice(["Cardio", "Fuerza"]),
+                "hours": round(rng.uniform(0.25, 3.0), 2),
+                "date": dt, "year": dt.year, "month": dt.month,
+                "week": dt.isocalendar().week, "created_at": datetime.utcnow(),
+            })
+            if len(batch) >= 5000:
+                metrics_log.insert_many(batch, ordered=False)
+                batch = []
+    if batch:
+        metrics_log.insert_many(batch, ordered=False)
+    for uid in ids.values():
+        rollups.rebuild(uid)
+    return emails
+
+
+# ----------------------------- Escenarios -------------------------------------
+# Cada escenario recibe (client, ctx, rng) y devuelve el status HTTP
+def _today():
+    return date.today().isoformat()
+
+
+def sc_health(c, ctx, rng):
+    return c.request("GET", "/health")[0]
+
+
+def sc_register(c, ctx, rng):
+    email = f"new-{ctx['run']}-{rng.getrandbits(32):x}@{BENCH_DOMAIN}"
+    return c.request("POST", "/auth/register", {"email": email, "password": BENCH_PASSWORD})[0]
+
+
+def sc_login(c, ctx, rng):
+    return c.request("POST", "/auth/login",
+                     {"email": rng.choice(ctx["emails"]), "password": BENCH_PASSWORD})[0]
+
+
+def sc_dashboard_metrics(c, ctx, rng):
+    return c.request("GET", "/dashboard/metrics", token=rng.choice(ctx["tokens"]))[0]
+
+
+def sc_dashboard(c, ctx, rng):
+    return c.request("GET", "/dashboard?months=6", token=rng.choice(ctx["tokens"]))[0]
+
+
+def sc_metrics_create(c, ctx, rng):
+    body = {"type": rng.choice(["Cardio", "Fuerza"]), "hours": 1, "date": _today()}
+    return c.request("POST", "/metrics", body, token=rng.choice(ctx["tokens"]))[0]
+
+
+def sc_metrics_list(c, ctx, rng):
+    return c.request("GET", "/metrics", token=rng.choice(ctx["tokens"]))[0]
+
+
+def sc_metrics_list_page(c, ctx, rng):
+    return c.request("GET", "/metrics?limit=50", token=rng.choice(ctx["tokens"]))[0]
+
+
+def _own_metric(c, token, rng):
+    body = {"type": "Cardio", "hours": 1, "date": _today()}
+    c.request("POST", "/metrics", body, token=token)
+    _, page = c.request("GET", "/metrics?limit=1", token=token)
+    return page["items"][0]["_id"]
+
+
+def sc_metrics_update(c, ctx, rng):
+    token = rng.choice(ctx["tokens"])
+    if token not in ctx["owned"]:
+        ctx["owned"][token] = _own_metric(c, token, rng)
+    mid = ctx["owned"][token]
+    body = {"type": rng.choice(["Cardio", "Fuerza"]), "hours": rng.randint(1, 3),
+            "date": _today()}
+    return c.request("PUT", f"/metrics/{mid}", body, token=token)[0]
+
+
+def sc_metrics_delete(c, ctx, rng):
+    token = rng.choice(ctx["tokens"])
+    mid = _own_metric(c, token, rng)
+    return c.request("DELETE", f"/metrics/{mid}", token=token)[0]
+
+
+def sc_summary_current_month(c, ctx, rng):
+    return c.request("GET", "/metrics/summary-current-month", token=rng.choice(ctx["tokens"]))[0]
+
+
+def sc_summary_by_month(c, ctx, rng):
+    return c.request("GET", "/metrics/summary-by-month?limit=6",
+                     token=rng.choice(ctx["tokens"]))[0]
+
+
+def sc_metrics_export(c, ctx, rng):
+    return c.request("GET", "/metrics/export?format=csv", token=rng.choice(ctx["tokens"]))[0]
+
+
+SCENARIOS = {
+    "GET /health": sc_health,
+    "POST /auth/register": sc_register,
+    "POST /auth/login": sc_login,
+    "GET /dashboard/metrics": sc_dashboard_metrics,
+    "GET /dashboard": sc_dashboard,
+    "POST /metrics": sc_metrics_create,
+    "GET /metrics": sc_metrics_list,
+    "GET /metrics?limit=50": sc_metrics_list_page,
+    "PUT /metrics/<id>": sc_metrics_update,
+    "DELETE /metrics/<id>": sc_metrics_delete,
+    "GET /metrics/summary-current-month": sc_summary_current_month,
+    "GET /metrics/summary-by-month": sc_summary_by_month,
+    "GET /metrics/export": sc_metrics_export,
+}
+
+
+# ----------------------------- Ejecución --------------------------------------
+def percentile(sorted_vals, p):
+    if not sorted_vals:
+        return 0.0
+    # nearest-rank
+    k = max(0, math.ceil(p / 100 * len(sorted_vals)) - 1)
+    return sorted_vals[k]
+
+
+def run_scenario(client, ctx, fn, requests, concurrency, seed_value):
+    latencies, errors = [], 0
+    lock = threading.Lock()
+
+    def one(i):
+        nonlocal errors
+        rng = random.Random(seed_value + i)
+        t0 = time.perf_counter()
+        try:
+            status = fn(client, ctx, rng)
+        except Exception:
+            status = 599
+        dt = time.perf_counter() - t0
+        with lock:
+            latencies.append(dt)
+            if status >= 400:
+                errors += 1
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as ex:
+        list(ex.map(one, range(requests)))
+    wall = time.perf_counter() - t0
+    latencies.sort()
+    ms = lambda v: round(v * 1000, 2)  # noqa: E731
+    return {
+        "requests": requests,
+        "errors": errors,
+        "throughput_rps": round(requests / wall, 1) if wall else 0.0,
+        "p50_ms": ms(percentile(latencies, 50)),
+        "p95_ms": ms(percentile(latencies, 95)),
+        "p99_ms": ms(percentile(latencies, 99)),
+        "mean_ms": ms(sum(latencies) / len(latencies)) if latencies else 0.0,
+    }
+
+
+def compare(current, baseline, threshold):
+    """Regresiones: p95 más lento o throughput menor que baseline × (1 ± threshold)."""
+    out = []
+    for name, cur in current["results"].items():
+        base = baseline.get("results", {}).get(name)
+        if not base:
+            continue
+        if base["p95_ms"] and cur["p95_ms"] > base["p95_ms"] * (1 + threshold):
+            out.append(f"{name}: p95 {base['p95_ms']} → {cur['p95_ms']} ms")
+        if base["throughput_rps"] and cur["throughput_rps"] < base["throughput_rps"] * (1 - threshold):
+            out.append(f"{name}: throughput {base['throughput_rps']} → {cur['throughput_rps']} rps")
+    return out
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return None
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--base-url", default=os.getenv("BENCH_BASE_URL", "http://localhost:5000/api"))
+    ap.add_argument("--in-process", action="store_true", help="Flask test client en vez de HTTP")
+    ap.add_argument("--users", type=int, default=20)
+    ap.add_argument("--sessions", type=int, default=200, help="Sesiones por usuario")
+    ap.add_argument("--concurrency", type=int, default=8)
+    ap.add_argument("--requests", type=int, default=200, help="Peticiones por endpoint")
+    ap.add_argument("--only", action="append", help="Solo estos escenarios (repetible)")
+    ap.add_argument("--skip-seed", action="store_true")
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--out", help="Archivo JSON de salida (por defecto stdout)")
+    ap.add_argument("--compare", help="JSON de una corrida anterior")
+    ap.add_argument("--threshold", type=float, default=0.15)
+    args = ap.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    t0 = time.perf_counter()
+    emails = (seed(args.users, args.sessions, rng) if not args.skip_seed
+              else [f"user{i}@{BENCH_DOMAIN}" for i in range(args.users)])
+    seed_s = time.perf_counter() - t0
+
+    client = InProcessClient() if args.in_process else HttpClient(args.base_url)
+    tokens = []
+    for e in emails:
+        status, body = client.request("POST", "/auth/login", {"email": e, "password": BENCH_PASSWORD})
+        if status != 200:
+            sys.exit(f"login de {e} falló ({status}): ¿se sembró la base?")
+        tokens.append(body["access_token"])
+    ctx = {"emails": emails, "tokens": tokens, "owned": {}, "run": f"{time.time_ns():x}"}
+
+    results = {}
+    for name, fn in SCENARIOS.items():
+        if args.only and name not in args.only:
+            continue
+        results[name] = run_scenario(client, ctx, fn, args.requests, args.concurrency, args.seed)
+        print(f"{name:38} {results[name]['throughput_rps']:>8} rps  "
+              f"p50 {results[name]['p50_ms']:>8} ms  p95 {results[name]['p95_ms']:>8} ms  "
+              f"p99 {results[name]['p99_ms']:>8} ms  err {results[name]['errors']}",
+              file=sys.stderr)
+
+    report = {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": datetime.utcnow().isoformat() + "Z",
+            "mode": "in-process" if args.in_process else args.base_url,
+            "users": args.users, "sessions_per_user": args.sessions,
+            "concurrency": args.concurrency, "requests_per_endpoint": args.requests,
+            "seed_seconds": round(seed_s, 2),
+        },
+        "results": results,
+    }
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.threshold)
+        for r in regressions:
+            print(f"REGRESIÓN {r}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+"""Caché de respuestas por usuario con TTL, LRU y ETag/304.
+
+La clave incluye un contador de versión por usuario: las escrituras de métricas
+lo incrementan (`invalidate`) y todas las entradas previas quedan obsoletas sin
+tener que borrarlas. El ETag se deriva de la clave, por lo que un
+`If-None-Match` vigente se responde con 304 sin consultar Mongo ni serializar.
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from functools import wraps
+
+from flask import Response, current_app, request
+
+
+class MemoryBackend:
+    """En proceso: LRU acotado + TTL. Las versiones viven en el mismo proceso."""
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            hit = self._data.get(key)
+            if hit is None:
+                return None
+            body, expires = hit
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return body
+
+    def set(self, key, body, ttl):
+        with self._lock:
+            self._data[key] = (body, time.monotonic() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def version(self, scope):
+        with self._lock:
+            return self._versions.get(scope, 0)
+
+    def bump(self, scope):
+        with self._lock:
+            self._versions[scope] = self._versions.get(scope, 0) + 1
+
+    def __len__(self):
+        return len(self._data)
+
+
+class MongoBackend:
+    """Compartido entre workers: cuerpos en `response_cache` (índice TTL) y
+    versiones en `cache_versions`. Delante se mantiene un LRU local pequeño."""
+
+    def __init__(self, db, max_entries=256):
+        self.db = db
+        self.local = MemoryBackend(max_entries)
+
+    # El índice TTL de response_cache está declarado en indexes.py
+    @property
+    def entries(self):
+        return self.db.response_cache
+
+    @property
+    def versions(self):
+        return self.db.cache_versions
+
+    def get(self, key):
+        body = self.local.get(key)
+        if body is not None:
+            return body
+        doc = self.entries.find_one({"_id": key, "expires_at": {"$gt": datetime.utcnow()}})
+        return doc["body"] if doc else None
+
+    def set(self, key, body, ttl):
+        self.local.set(key, body, ttl)
+        self.entries.replace_one(
+            {"_id": key},
+            {"body": body, "expires_at": datetime.utcnow() + timedelta(seconds=ttl)},
+            upsert=True,
+        )
+
+    def version(self, scope):
+        doc = self.versions.find_one({"_id": scope})
+        return doc["v"] if doc else 0
+
+    def bump(self, scope):
+        self.versions.update_one({"_id": scope}, {"$inc": {"v": 1}}, upsert=True)
+
+    def __len__(self):
+        return len(self.local)
+
+
+class ResponseCache:
+    def __init__(self, backend, ttl=60):
+        self.backend = backend
+        self.ttl = ttl
+        self._stats_lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "not_modified": 0, "invalidations": 0}
+
+    def _bump(self, name):
+        with self._stats_lock:
+            self._stats[name] += 1
+
+    def invalidate(self, scope):
+        self.backend.bump(scope)
+        self._bump("invalidations")
+
+    def cached(self, endpoint, scope_fn, ttl=None, vary_fn=None, version_fn=None):
+        """Decorador para GET JSON. `scope_fn()` devuelve el user_id (o "global");
+        `vary_fn()` agrega a la clave lo que se negocia por headers (p. ej. formato);
+        `version_fn()` la versión de datos que no se invalidan con `invalidate`
+        (p. ej. una vista refrescada por otro proceso), y entra también al ETag."""
+        ttl = ttl or self.ttl
+
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                scope = scope_fn()
+                if not scope:
+                    return view(*args, **kwargs)
+                args_key = "&".join(f"{k}={v}" for k, v in sorted(request.args.items()))
+                if vary_fn:
+                    args_key += f"|{vary_fn()}"
+                if version_fn:
+                    args_key += f"|v={version_fn()}"
+                # La fecha entra en la clave: los resúmenes dependen de "hoy"
+                key = (f"{endpoint}:{scope}:{self.backend.version(scope)}:"
+                       f"{date.today().isoformat()}:{args_key}")
+                etag = hashlib.sha1(key.encode()).hexdigest()[:20]
+
+                # Comparación débil: gzip marca el ETag como W/"..."
+                if request.if_none_match.contains_weak(etag):
+                    self._bump("not_modified")
+                    return self._response(None, etag, ttl, status=304, vary=bool(vary_fn))
+
+                body = self.backend.get(key)
+                if body is None:
+                    self._bump("misses")
+                    rv = view(*args, **kwargs)
+                    if not isinstance(rv, dict):
+                        return rv  # errores / respuestas no cacheables
+                    body = current_app.json.dumps(rv).encode()
+                    self.backend.set(key, body, ttl)
+                else:
+                    self._bump("hits")
+                return self._response(body, etag, ttl, vary=bool(vary_fn))
+            return wrapper
+        return decorator
+
+    @staticmethod
+    def _response(body, etag, ttl, status=200, vary=False):
+        resp = Response(body, status=status, mimetype="application/json")
+        resp.set_etag(etag)
+        if vary:
+            resp.vary.add("Accept")
+        # private: depende del usuario; no-cache: el navegador revalida con ETag
+        resp.headers["Cache-Control"] = "private, no-cache"
+        return resp
+
+    def stats(self):
+        with self._stats_lock:
+            out = dict(self._stats)
+        out["entries"] = len(self.backend)
+        return out
+
+
+def cache_from_env(mdb):
+    # Con varios workers la caché en memoria es una por proceso: las
+    # invalidaciones y versiones de un worker no llegan a los demás
+    shared = int(os.getenv("WEB_WORKERS", 1)) > 1
+    kind = os.getenv("CACHE_BACKEND", "mongo" if shared else "memory")
+    if kind == "memory" and shared:
+        raise RuntimeError("CACHE_BACKEND=memory no sirve con WEB_WORKERS > 1; "
+                           "usa CACHE_BACKEND=mongo")
+    max_entries = int(os.getenv("CACHE_MAX_ENTRIES", 1024))
+    if kind == "mongo":
+        backend = MongoBackend(mdb, max_entries=max_entries)
+    else:
+        backend = MemoryBackend(max_entries=max_entries)
+    return ResponseCache(backend, ttl=int(os.getenv("CACHE_TTL", 60)))
@@ -0,0 +1,182 @@
+"""Pool de conexiones Postgres compartido por todos los handlers."""
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import pool as pg_pool
+from psycopg2.extras import RealDictCursor
+
+from background import Counters
+from instrumentation import TimedCursor
+
+
+class PoolTimeout(Exception):
+    """No se obtuvo una conexión libre dentro del tiempo de espera."""
+
+
+class _KeepIdlePool(pg_pool.ThreadedConnectionPool):
+    """ThreadedConnectionPool que conserva hasta maxconn conexiones libres.
+
+    El original abre `minconn` al crearse y cierra toda conexión devuelta por
+    encima de ese número: con concurrencia casi cada checkout abriría una
+    conexión nueva (TCP + auth). `_putconn` solo consulta `minconn` para
+    decidir si la guarda, así que tras abrir las iniciales se sube a maxconn.
+    """
+
+    def __init__(self, minconn, maxconn, *args, **kwargs):
+        super().__init__(minconn, maxconn, *args, **kwargs)
+        self.minconn = maxconn
+
+
+class PgPool(Counters):
+    """Pool acotado (min/max) sobre ThreadedConnectionPool.
+
+    - Reutiliza hasta `maxconn` conexiones libres (no solo `minconn`).
+    - Espera con timeout cuando el pool está saturado (en vez de fallar).
+    - Verifica con SELECT 1 las conexiones libres hace más de `probe_after`
+      segundos y reconecta si están rotas.
+    - Lleva contadores de espera y saturación (ver /api/internal/stats).
+    """
+
+    def __init__(self, dsn, minconn=1, maxconn=10, timeout=5.0, probe_after=30.0,
+                 cursor_factory=RealDictCursor):
+        self.dsn = dsn
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.probe_after = probe_after
+        self.cursor_factory = cursor_factory
+        self._pool = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._idle_since = {}      # id(conn) → momento en que volvió al pool
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._init_stats(
+            checkouts=0,
+            in_use=0,
+            waits=0,            # checkouts que tuvieron que esperar
+            wait_seconds=0.0,   # tiempo total esperando un slot
+            timeouts=0,         # checkouts que agotaron el timeout
+            reconnects=0,       # conexiones rotas descartadas
+        )
+
+    # ----------------------------- Internos -----------------------------------
+    def _get_pool(self):
+        # Se crea perezosamente y se recrea si el proceso fue forkeado
+        pid = os.getpid()
+        if self._pool is None or self._pid != pid:
+            with self._lock:
+                if self._pool is None or self._pid != pid:
+                    self._pool = _KeepIdlePool(
+                        self.minconn, self.maxconn, self.dsn,
+                        cursor_factory=self.cursor_factory,
+                    )
+                    self._pid = pid
+                    self._idle_since = {}
+                    self._slots = threading.BoundedSemaphore(self.maxconn)
+        return self._pool
+
+    def _is_alive(self, conn):
+        """Deja la conexión en autocommit y, si estuvo libre más de
+        `probe_after` (o no se sabe desde cuándo), la verifica con SELECT 1.
+        El autocommit va antes del probe: psycopg2 no permite cambiarlo con
+        una transacción abierta, y el SELECT abriría una."""
+        if conn.closed:
+            return False
+        idle_since = self._idle_since.pop(id(conn), None)
+        try:
+            if not conn.autocommit:
+                conn.rollback()
+                conn.autocommit = True
+            if idle_since is not None and time.monotonic() - idle_since < self.probe_after:
+                return True
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1;")
+            return True
+        except psycopg2.Error:
+            return False
+
+    # ----------------------------- API ----------------------------------------
+    def getconn(self):
+        pool = self._get_pool()
+        slots = self._slots
+        t0 = time.perf_counter()
+        if not slots.acquire(blocking=False):
+            self._bump(waits=1)
+            if not slots.acquire(timeout=self.timeout):
+                self._bump(timeouts=1, wait_seconds=time.perf_counter() - t0)
+                raise PoolTimeout("pool de Postgres saturado")
+            self._bump(wait_seconds=time.perf_counter() - t0)
+
+        conn = None
+        try:
+            conn = pool.getconn()
+            if not self._is_alive(conn):
+                pool.putconn(conn, close=True)
+                conn = None
+                self._bump(reconnects=1)
+                conn = pool.getconn()
+                if not self._is_alive(conn):
+                    raise psycopg2.OperationalError("no se pudo conectar a Postgres")
+        except Exception:
+            # La conexión (si se obtuvo) vuelve al pool cerrada: no se filtra
+            if conn is not None:
+                pool.putconn(conn, close=True)
+            slots.release()
+            raise
+        self._bump(checkouts=1, in_use=1)
+        return conn
+
+    def putconn(self, conn, close=False):
+        try:
+            close = close or conn.closed != 0
+            if not close:
+                self._idle_since[id(conn)] = time.monotonic()
+            self._get_pool().putconn(conn, close=close)
+        finally:
+            self._bump(in_use=-1)
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        conn = self.getconn()
+        broken = False
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        finally:
+            self.putconn(conn, close=broken)
+
+    @contextmanager
+    def cursor(self):
+        """Checkout por petición: `with pg_pool.cursor() as cur: ...`."""
+        with self.connection() as conn:
+            with conn.cursor() as cur:
+                yield cur
+
+    def stats(self):
+        out = self._snapshot()
+        out.update({"min": self.minconn, "max": self.maxconn,
+                    "saturated": out["in_use"] >= self.maxconn})
+        return out
+
+    def closeall(self):
+        with self._lock:
+            if self._pool is not None and self._pid == os.getpid():
+                self._pool.closeall()
+            self._pool = None
+
+
+def pool_from_env():
+    return PgPool(
+        os.getenv("DATABASE_URL"),
+        minconn=int(os.getenv("PG_POOL_MIN", 1)),
+        maxconn=int(os.getenv("PG_POOL_MAX", 10)),
+        timeout=float(os.getenv("PG_POOL_TIMEOUT", 5)),
+        probe_after=float(os.getenv("PG_POOL_PROBE_AFTER", 30)),
+        cursor_factory=TimedCursor,
+    )
@@ -0,0 +1,115 @@
+"""Recursos compartidos de la app, creados perezosamente en cada proceso.
+
+Nada aquí abre conexiones al importar: Mongo, Postgres, el pool de bcrypt y el
+hilo del outbox se crean en el primer uso dentro de cada worker (después del
+fork), y se recrean si el proceso cambia de PID.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+from flask_jwt_extended import JWTManager
+from flask_mail import Mail
+from itsdangerous import URLSafeTimedSerializer
+from pymongo import MongoClient
+
+from cache import cache_from_env
+from db import pool_from_env
+from hashing import hasher_from_env
+from instrumentation import MongoCommandTimer
+from outbox import Outbox
+from ratelimit import limiter_from_env
+from views import GlobalViews
+from write_behind import write_behind_from_env
+from rollups import RollupStore
+
+
+class LazyResource:
+    """Proxy que construye el objeto real en el primer acceso de cada proceso."""
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._obj = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        pid = os.getpid()
+        if self._obj is None or self._pid != pid:
+            with self._lock:
+                if self._obj is None or self._pid != pid:
+                    self._obj = self._factory()
+                    self._pid = pid
+        return self._obj
+
+    def created(self):
+        """El objeto ya creado en este proceso, o None (no lo construye)."""
+        return self._obj if self._pid == os.getpid() else None
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
+    def __getitem__(self, key):
+        return self.get()[key]
+
+
+# Flask extensions (se enlazan en create_app con init_app)
+mail = Mail()
+jwt = JWTManager()
+
+# Mongo
+mongo = LazyResource(lambda: MongoClient(os.getenv("MONGODB_URI"),
+                                         event_listeners=[MongoCommandTimer()]))
+mdb = LazyResource(lambda: mongo.get().app)
+metrics = LazyResource(lambda: mdb.get().metrics)
+metrics_log = LazyResource(lambda: mdb.get().metrics_log)
+
+# Postgres (pool compartido; cada handler hace checkout/return por petición)
+pg_pool = pool_from_env()
+
+# bcrypt en un pool de procesos dedicado (costo y concurrencia configurables)
+hasher = hasher_from_env()
+
+# Límite de intentos en auth (token bucket por IP/email) + admisión a bcrypt
+rate_limiter = limiter_from_env(mdb, hasher)
+
+# Rollups por usuario × mes/semana ISO × tipo (ver rollups.py)
+rollups = RollupStore(LazyResource(lambda: mdb.get().metrics_rollup), metrics_log)
+
+# Caché de respuestas (dashboard y resúmenes), invalidada por escrituras
+response_cache = cache_from_env(mdb)
+
+# Buffer write-behind de POST /api/metrics (opcional, WRITE_BEHIND=1)
+write_buffer = write_behind_from_env(metrics_log, rollups, response_cache)
+
+# Vistas materializadas globales (dashboard), refrescadas en segundo plano
+global_views = GlobalViews(mdb, metrics_log, LazyResource(lambda: mdb.get().metrics_rollup))
+
+# Outbox de correos (persistido en Mongo, enviado por un hilo de fondo)
+outbox = Outbox(LazyResource(lambda: mdb.get().mail_outbox), mail)
+
+
+# Hilos para las sub-consultas concurrentes de GET /api/dashboard
+dashboard_executor = LazyResource(lambda: ThreadPoolExecutor(
+    max_workers=int(os.getenv("DASHBOARD_WORKERS", 8)), thread_name_prefix="dashboard"))
+
+
+def serializer():
+    """Firmador de tokens de reseteo, uno por app."""
+    ext = current_app.extensions
+    if "reset_serializer" not in ext:
+        ext["reset_serializer"] = URLSafeTimedSerializer(current_app.config["JWT_SECRET_KEY"])
+    return ext["reset_serializer"]
+
+
+def shutdown():
+    """Libera recursos del proceso actual (salida de un worker)."""
+    write_buffer.stop()  # antes que nada: vacía los inserts pendientes
+    outbox.stop()
+    global_views.stop()
+    executor = dashboard_executor.created()
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
+    hasher.shutdown()
+    pg_pool.closeall()
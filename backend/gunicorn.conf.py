@@ -0,0 +1,47 @@
+# Configuración de gunicorn para producción:
+#   gunicorn -c gunicorn.conf.py "app:create_app()"
+# Cada worker crea sus propias conexiones (ver extensions.py), por eso no se
+# usa preload_app: nada se abre antes del fork.
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', 5000)}"
+
+# Procesos × hilos: los hilos cubren la espera de I/O (Mongo/Postgres). El
+# valor por defecto se acota: cada worker abre su propio pool de Postgres
+workers = int(os.getenv("WEB_WORKERS", min(multiprocessing.cpu_count() * 2 + 1, 4)))
+threads = int(os.getenv("WEB_THREADS", 4))
+worker_class = "gthread"
+
+# Los workers heredan el entorno del master: la app ve cuántos procesos hay
+# (caché y rate limiter compartidos si son varios) y, salvo que se fije, cada
+# pool de Postgres tiene una conexión por hilo (una petición usa a lo sumo una)
+os.environ["WEB_WORKERS"] = str(workers)
+os.environ.setdefault("PG_POOL_MAX", str(threads))
+
+# Keep-alive detrás de nginx y timeouts
+keepalive = int(os.getenv("WEB_KEEPALIVE", 5))
+timeout = int(os.getenv("WEB_TIMEOUT", 30))
+graceful_timeout = int(os.getenv("WEB_GRACEFUL_TIMEOUT", 30))
+
+# Reciclado de workers para acotar fugas de memoria
+max_requests = int(os.getenv("WEB_MAX_REQUESTS", 5000))
+max_requests_jitter = int(os.getenv("WEB_MAX_REQUESTS_JITTER", 500))
+
+accesslog = "-"
+errorlog = "-"
+
+
+def on_starting(server):
+    # workers × PG_POOL_MAX no debe pasar de max_connections de Postgres
+    total = workers * int(os.environ["PG_POOL_MAX"])
+    budget = int(os.getenv("PG_MAX_CONNECTIONS", 100))
+    if total > budget:
+        server.log.warning("WEB_WORKERS × PG_POOL_MAX = %d conexiones a Postgres, "
+                           "más que PG_MAX_CONNECTIONS (%d)", total, budget)
+
+
+def worker_exit(server, worker):
+    # Recarga elegante (SIGHUP) o apagado: cerrar pool, outbox y bcrypt del worker
+    import extensions
+    extensions.shutdown()
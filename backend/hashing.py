@@ -0,0 +1,135 @@
+"""Hash/verificación bcrypt fuera del hilo de la petición.
+
+El trabajo de bcrypt se ejecuta en un pool de procesos dedicado con un tope de
+concurrencia y una cola acotada; cuando la cola está llena se rechaza con
+HashingBusy (→ 429 + Retry-After) en lugar de acumular peticiones.
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from passlib.hash import bcrypt
+
+from background import Counters
+from instrumentation import timed
+
+
+class HashingBusy(Exception):
+    """La cola de hashing está llena; el cliente debe reintentar."""
+
+    def __init__(self, retry_after=1):
+        super().__init__("cola de hashing llena")
+        self.retry_after = retry_after
+
+
+# Funciones de módulo para que sean serializables hacia los procesos hijos
+def _hash(password, rounds):
+    return bcrypt.using(rounds=rounds).hash(password)
+
+
+def _verify(password, password_hash):
+    return bcrypt.verify(password, password_hash)
+
+
+class PasswordHasher(Counters):
+    def __init__(self, workers=2, max_pending=16, rounds=12,
+                 queue_timeout=0.05, retry_after=1):
+        self.workers = workers
+        self.max_pending = max_pending      # en ejecución + en cola
+        self.rounds = rounds
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._init_stats(submitted=0, pending=0, rejected=0, rehashed=0, restarts=0)
+
+    def _get_executor(self):
+        # Perezoso y fork-safe: cada proceso worker crea su propio pool
+        pid = os.getpid()
+        if self._executor is None or self._pid != pid:
+            with self._lock:
+                if self._executor is None or self._pid != pid:
+                    # forkserver: los hijos no heredan hilos ni sockets del worker
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.workers,
+                        mp_context=multiprocessing.get_context("forkserver"),
+                    )
+                    if self._pid != pid:
+                        self._slots = threading.BoundedSemaphore(self.max_pending)
+                    self._pid = pid
+        return self._executor
+
+    def _discard(self, executor):
+        """Descarta un pool roto para que el próximo uso cree otro."""
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False)
+
+    def _run(self, fn, *args):
+        executor = self._get_executor()
+        slots = self._slots
+        if not slots.acquire(timeout=self.queue_timeout):
+            self._bump(rejected=1)
+            raise HashingBusy(self.retry_after)
+        self._bump(submitted=1, pending=1)
+        try:
+            with timed("bcrypt", fn.__name__.lstrip("_")):
+                try:
+                    return executor.submit(fn, *args).result()
+                except BrokenProcessPool:
+                    # Un hijo murió (OOM, kill): se recrea el pool y se reintenta una vez
+                    self._discard(executor)
+                    self._bump(restarts=1)
+                    return self._get_executor().submit(fn, *args).result()
+        finally:
+            self._bump(pending=-1)
+            slots.release()
+
+    # ----------------------------- API ----------------------------------------
+    def hash(self, password):
+        return self._run(_hash, password, self.rounds)
+
+    def verify(self, password, password_hash):
+        return self._run(_verify, password, password_hash)
+
+    def needs_rehash(self, password_hash):
+        """True si el hash fue generado con un costo distinto al configurado."""
+        try:
+            return bcrypt.from_string(password_hash).rounds != self.rounds
+        except ValueError:
+            return True
+
+    def saturated(self):
+        """True si la cola está llena: un trabajo nuevo sería rechazado."""
+        with self._stats_lock:
+            return self._stats["pending"] >= self.max_pending
+
+    def mark_rehashed(self):
+        self._bump(rehashed=1)
+
+    def stats(self):
+        out = self._snapshot()
+        out.update({"workers": self.workers, "max_pending": self.max_pending,
+                    "rounds": self.rounds})
+        return out
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None and self._pid == os.getpid():
+                self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+def hasher_from_env():
+    return PasswordHasher(
+        workers=int(os.getenv("HASH_WORKERS", 2)),
+        max_pending=int(os.getenv("HASH_MAX_PENDING", 16)),
+        rounds=int(os.getenv("BCRYPT_ROUNDS", 12)),
+        queue_timeout=float(os.getenv("HASH_QUEUE_TIMEOUT", 0.05)),
+        retry_after=int(os.getenv("HASH_RETRY_AFTER", 1)),
+    )
@@ -0,0 +1,244 @@
+"""Registro de las formas de consulta que emite la API y los índices que las sirven.
+
+`ensure_indexes(db)` crea todo lo declarado (y elimina índices obsoletos).
+`verify_plans(db)` ejecuta explain() sobre cada forma y reporta las que caen en
+COLLSCAN, ordenan en memoria o examinan muchas más claves que docs devueltos.
+`seed(db, ...)` genera datos sintéticos para verificar en una base desechable.
+"""
+import random
+from datetime import datetime, timedelta
+
+from pymongo import ASCENDING, DESCENDING, IndexModel
+
+from metrics_schema import ITEM_PROJECTION
+from views import ACTIVE_WINDOW_DAYS, STREAK_WINDOW_DAYS, TOP_STREAKS
+
+# ----------------------------- Índices declarados -----------------------------
+INDEXES = {
+    "metrics_log": [
+        # Listado/paginación keyset, export y lookups por usuario
+        IndexModel([("user_id", ASCENDING), ("date", DESCENDING), ("_id", DESCENDING)]),
+        # Idempotencia de la ingesta masiva
+        IndexModel([("user_id", ASCENDING), ("idempotency_key", ASCENDING)], unique=True,
+                   partialFilterExpression={"idempotency_key": {"$type": "string"}}),
+        # Marca de agua de las vistas globales (views.py)
+        IndexModel([("created_at", ASCENDING)]),
+        IndexModel([("updated_at", ASCENDING)], sparse=True),
+    ],
+    "metrics_rollup": [
+        # Resúmenes mes/semana y "por mes" (orden year/bucket desc)
+        IndexModel([("user_id", ASCENDING), ("period", ASCENDING), ("year", ASCENDING),
+                    ("bucket", ASCENDING), ("type", ASCENDING)], unique=True),
+        # Totales globales de la semana (vistas globales)
+        IndexModel([("period", ASCENDING), ("year", ASCENDING), ("bucket", ASCENDING)]),
+    ],
+    "mail_outbox": [
+        IndexModel([("status", ASCENDING), ("next_attempt_at", ASCENDING)]),
+        # Los enviados se borran a los 7 días (solo los docs con sent_at)
+        IndexModel([("sent_at", ASCENDING)], expireAfterSeconds=7 * 24 * 3600),
+    ],
+    # Backend compartido de la caché de respuestas (CACHE_BACKEND=mongo)
+    "response_cache": [
+        IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0),
+    ],
+    # Vistas globales: actividad por usuario y lápidas de borrado (7 días)
+    "user_activity": [
+        IndexModel([("last_active", ASCENDING)]),
+        IndexModel([("current_streak", DESCENDING)]),
+    ],
+    "metrics_tombstones": [
+        IndexModel([("deleted_at", ASCENDING)], expireAfterSeconds=7 * 24 * 3600),
+    ],
+    # Buckets compartidos del rate limiter (RATE_LIMIT_BACKEND=mongo)
+    "rate_limits": [
+        IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0),
+    ],
+}
+
+# Índices creados por versiones anteriores que ya no sirven a ninguna consulta:
+# (user_id, date) queda cubierto por (user_id, date, _id) y ningún endpoint
+# filtra solo por (year, month)
+OBSOLETE_INDEXES = {
+    "metrics_log": ["user_id_1_date_1", "year_1_month_1"],
+}
+
+
+class QueryShape:
+    """Una consulta tal como la emite un endpoint, parametrizada por `s` (muestra)."""
+
+    def __init__(self, name, collection, filter_fn, sort=None, projection=None,
+                 limit=None, used_by=""):
+        self.name = name
+        self.collection = collection
+        self.filter_fn = filter_fn
+        self.sort = sort
+        self.projection = projection
+        self.limit = limit
+        self.used_by = used_by
+
+    def cursor(self, db, sample):
+        cur = db[self.collection].find(self.filter_fn(sample), self.projection)
+        if self.sort:
+            cur = cur.sort(self.sort)
+        if self.limit:
+            cur = cur.limit(self.limit)
+        return cur
+
+
+_DATE_ID_DESC = [("date", DESCENDING), ("_id", DESCENDING)]
+
+QUERY_SHAPES = [
+    QueryShape("metrics.list", "metrics_log",
+               lambda s: {"user_id": s["user_id"]},
+               sort=_DATE_ID_DESC, projection=ITEM_PROJECTION,
+               used_by="GET /api/metrics"),
+    QueryShape("metrics.list.page", "metrics_log",
+               lambda s: {"user_id": s["user_id"],
+                          "$or": [{"date": {"$lt": s["date"]}},
+                                  {"date": s["date"], "_id": {"$lt": s["_id"]}}]},
+               sort=_DATE_ID_DESC, projection=ITEM_PROJECTION,
+               limit=50, used_by="GET /api/metrics?cursor="),
+    QueryShape("metrics.export", "metrics_log",
+               lambda s: {"user_id": s["user_id"], "date": {"$lte": s["date"]}},
+               sort=[("date", ASCENDING), ("_id", ASCENDING)], projection=ITEM_PROJECTION,
+               used_by="GET /api/metrics/export?to="),
+    QueryShape("metrics.by_id", "metrics_log",
+               lambda s: {"_id": s["_id"], "user_id": s["user_id"]},
+               used_by="PUT/DELETE /api/metrics/<id>"),
+    QueryShape("rollup.month", "metrics_rollup",
+               lambda s: {"user_id": s["user_id"], "period": "month",
+                          "year": s["year"], "bucket": s["month"]},
+               projection={"_id": 0, "type": 1, "hours": 1},
+               used_by="GET /api/metrics/summary-current-month"),
+    QueryShape("rollup.week", "metrics_rollup",
+               lambda s: {"user_id": s["user_id"], "period": "week",
+                          "year": s["year"], "bucket": s["week"]},
+               projection={"_id": 0, "type": 1, "hours": 1},
+               used_by="GET /api/metrics/summary-current-month"),
+    QueryShape("rollup.by_month", "metrics_rollup",
+               lambda s: {"user_id": s["user_id"], "period": "month"},
+               sort=[("year", DESCENDING), ("bucket", DESCENDING)],
+               projection={"_id": 0, "year": 1, "bucket": 1, "type": 1, "hours": 1},
+               used_by="GET /api/metrics/summary-by-month"),
+    QueryShape("outbox.claim", "mail_outbox",
+               lambda s: {"$or": [
+                   {"status": "pending", "next_attempt_at": {"$lte": s["now"]}},
+                   {"status": "sending", "locked_until": {"$lt": s["now"]}},
+               ]},
+               sort=[("next_attempt_at", ASCENDING)], limit=1,
+               used_by="outbox sender"),
+    # Refresco de las vistas globales (views.py); distinct/count_documents usan
+    # el mismo plan que un find con ese filtro
+    QueryShape("views.touched.created", "metrics_log",
+               lambda s: {"created_at": {"$gt": s["since"]}},
+               projection={"_id": 0, "user_id": 1}, used_by="vistas globales"),
+    QueryShape("views.touched.updated", "metrics_log",
+               lambda s: {"updated_at": {"$gt": s["since"]}},
+               projection={"_id": 0, "user_id": 1}, used_by="vistas globales"),
+    QueryShape("views.tombstones", "metrics_tombstones",
+               lambda s: {"deleted_at": {"$gt": s["since"]}},
+               projection={"_id": 0, "user_id": 1}, used_by="vistas globales"),
+    QueryShape("views.user_days", "metrics_log",
+               lambda s: {"user_id": s["user_id"],
+                          "date": {"$gte": s["today"] - timedelta(days=STREAK_WINDOW_DAYS)}},
+               projection={"_id": 0, "date": 1}, used_by="vistas globales"),
+    QueryShape("views.streaks", "user_activity",
+               lambda s: {"last_active": {"$gte": s["today"] - timedelta(days=1)},
+                          "current_streak": {"$gt": 0}},
+               sort=[("current_streak", DESCENDING)],
+               projection={"_id": 0, "current_streak": 1}, limit=TOP_STREAKS,
+               used_by="vistas globales"),
+    QueryShape("views.active", "user_activity",
+               lambda s: {"last_active": {"$gte": s["today"] - timedelta(
+                   days=ACTIVE_WINDOW_DAYS - 1)}},
+               projection={"_id": 0, "last_active": 1}, used_by="vistas globales"),
+]
+
+
+def ensure_indexes(db):
+    for coll, names in OBSOLETE_INDEXES.items():
+        existing = db[coll].index_information()
+        for name in names:
+            if name in existing:
+                db[coll].drop_index(name)
+    for coll, models in INDEXES.items():
+        db[coll].create_indexes(models)
+
+
+# ----------------------------- Verificación -----------------------------------
+def _stages(plan):
+    """Recorre el árbol del plan ganador y entrega los nombres de etapa."""
+    if not plan:
+        return
+    yield plan.get("stage")
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            yield from _stages(plan[key])
+    for child in plan.get("inputStages", []):
+        yield from _stages(child)
+
+
+def explain_shape(db, shape, sample, max_keys_ratio=2.0, slack=10):
+    """Devuelve dict con el resultado del explain y la lista de problemas."""
+    exp = shape.cursor(db, sample).explain()
+    winning = exp.get("queryPlanner", {}).get("winningPlan", {})
+    stats = exp.get("executionStats", {})
+    stages = [s for s in _stages(winning) if s]
+    n_returned = stats.get("nReturned", 0)
+    keys = stats.get("totalKeysExamined", 0)
+    docs = stats.get("totalDocsExamined", 0)
+
+    problems = []
+    if "COLLSCAN" in stages:
+        problems.append("COLLSCAN")
+    if "SORT" in stages:
+        problems.append("ordenamiento en memoria")
+    if keys > max_keys_ratio * n_returned + slack:
+        problems.append(f"examina {keys} claves para {n_returned} docs")
+    if docs > max_keys_ratio * n_returned + slack:
+        problems.append(f"examina {docs} docs para {n_returned} devueltos")
+    return {"shape": shape.name, "used_by": shape.used_by, "stages": stages,
+            "n_returned": n_returned, "keys_examined": keys,
+            "docs_examined": docs, "problems": problems}
+
+
+def verify_plans(db, sample, shapes=QUERY_SHAPES, **kw):
+    return [explain_shape(db, shape, sample, **kw) for shape in shapes]
+
+
+def seed(db, users=20, sessions=200, rollups=None, views=None, rng=None):
+    """Datos sintéticos para explain(); devuelve un doc de muestra para las formas.
+    Con `views` (GlobalViews) se hace un refresco completo para poblar user_activity."""
+    rng = rng or random.Random(42)
+    today = datetime.combine(datetime.utcnow().date(), datetime.min.time())
+    docs = []
+    for u in range(users):
+        for _ in range(sessions):
+            dt = today - timedelta(days=rng.randrange(0, 3 * 365))
+            docs.append({
+                "user_id": str(u + 1), "email": f"user{u + 1}@bench.local",
+                "type": rng.choice(["Cardio", "Fuerza"]),
+                "hours": round(rng.uniform(0.25, 3.0), 2),
+                "date": dt, "year": dt.year, "month": dt.month,
+                "week": dt.isocalendar().week, "created_at": datetime.utcnow(),
+            })
+    for i in range(0, len(docs), 5000):
+        db.metrics_log.insert_many(docs[i:i + 5000], ordered=False)
+    if rollups is not None:
+        rollups.rebuild()
+    now = datetime.utcnow()
+    # Ediciones y borrados recientes para las consultas de marca de agua
+    db.metrics_log.update_many({"user_id": "1"}, {"$set": {"updated_at": now}})
+    db.metrics_tombstones.insert_many([{"user_id": str(u + 1), "deleted_at": now}
+                                       for u in range(0, users, 5)])
+    if views is not None:
+        views.refresh(full=True)
+    db.mail_outbox.insert_many([
+        {"status": "sent" if i % 10 else "pending", "next_attempt_at": now,
+         "created_at": now, "subject": "x", "recipients": [], "body": ""}
+        for i in range(users * 10)
+    ])
+    sample = docs[len(docs) // 2]
+    return {"user_id": sample["user_id"], "date": sample["date"], "_id": sample["_id"],
+            "year": sample["year"], "month": sample["month"], "week": sample["week"],
+            "now": now, "today": today, "since": now - timedelta(seconds=60)}
@@ -0,0 +1,214 @@
+"""Instrumentación del hot path: histogramas por ruta y por componente.
+
+Cada petición acumula en `flask.g` cuánto tiempo pasó en bcrypt, Postgres,
+Mongo, serialización JSON y SMTP. Al terminar se observa todo en histogramas
+(exportados en formato texto de Prometheus) y, si la petición fue lenta, se
+registra el desglose junto con las formas de las consultas.
+"""
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g, has_request_context, request
+from flask.json.provider import DefaultJSONProvider
+from psycopg2.extras import RealDictCursor
+from pymongo import monitoring
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    def __init__(self, name, help_text, label_names, buckets=BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self._series = {}  # labels → [counts por bucket..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self._lock:
+            s = self._series.get(labels)
+            if s is None:
+                s = self._series[labels] = [0] * len(self.buckets) + [0.0, 0]
+            for i, b in enumerate(self.buckets):
+                if value <= b:
+                    s[i] += 1
+            s[-2] += value
+            s[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {k: list(v) for k, v in self._series.items()}
+        for labels, s in sorted(series.items()):
+            base = ",".join(f'{n}="{_escape(v)}"' for n, v in zip(self.label_names, labels))
+            sep = "," if base else ""
+            for i, b in enumerate(self.buckets):
+                lines.append(f'{self.name}_bucket{{{base}{sep}le="{b}"}} {s[i]}')
+            lines.append(f'{self.name}_bucket{{{base}{sep}le="+Inf"}} {s[-1]}')
+            lines.append(f"{self.name}_sum{{{base}}} {s[-2]}")
+            lines.append(f"{self.name}_count{{{base}}} {s[-1]}")
+        return "\n".join(lines)
+
+
+def _escape(v):
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "Latencia por ruta", ("route", "method", "status"))
+COMPONENT_SECONDS = Histogram(
+    "request_component_seconds", "Tiempo por componente dentro de cada ruta",
+    ("route", "component"))
+OPERATION_SECONDS = Histogram(
+    "operation_duration_seconds", "Latencia por operación (también fuera de peticiones)",
+    ("component", "operation"))
+
+SLOW_REQUEST_SECONDS = float(os.getenv("SLOW_REQUEST_MS", 500)) / 1000
+MAX_SHAPES_PER_REQUEST = 50
+
+
+# ----------------------------- Registro ---------------------------------------
+def record(component, seconds, operation="", shape=None):
+    """Observa una operación y la suma al desglose de la petición en curso."""
+    OPERATION_SECONDS.observe(seconds, component, operation)
+    if has_request_context() and "_timings" in g:
+        g._timings[component] = g._timings.get(component, 0.0) + seconds
+        if shape and len(g._shapes) < MAX_SHAPES_PER_REQUEST:
+            g._shapes.append(f"{component}: {shape} ({seconds * 1000:.1f} ms)")
+
+
+@contextmanager
+def timed(component, operation=""):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(component, time.perf_counter() - t0, operation)
+
+
+# ----------------------------- Postgres ---------------------------------------
+_SQL_LITERALS = re.compile(r"'[^']*'|\b\d+\b")
+
+
+def _sql_shape(sql):
+    sql = sql.decode() if isinstance(sql, bytes) else str(sql)
+    return _SQL_LITERALS.sub("?", " ".join(sql.split()))[:120]
+
+
+class TimedCursor(RealDictCursor):
+    """RealDictCursor que mide cada execute/executemany."""
+
+    def execute(self, query, vars=None):
+        t0 = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            shape = _sql_shape(query)
+            record("postgres", time.perf_counter() - t0, shape.split(" ", 1)[0], shape)
+
+    def executemany(self, query, vars_list):
+        t0 = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            shape = _sql_shape(query)
+            record("postgres", time.perf_counter() - t0, shape.split(" ", 1)[0], shape)
+
+
+# ----------------------------- Mongo ------------------------------------------
+_SHAPE_FIELDS = ("filter", "pipeline", "sort", "q")
+
+
+def _mongo_shape(event_command, name):
+    coll = event_command.get(name)
+    keys = []
+    for f in _SHAPE_FIELDS:
+        v = event_command.get(f)
+        if isinstance(v, dict):
+            keys.append(f"{f}={sorted(v.keys())}")
+        elif isinstance(v, list) and f == "pipeline":
+            keys.append("pipeline=" + ",".join(next(iter(st), "?") for st in v if isinstance(st, dict)))
+    return f"{name} {coll} {' '.join(keys)}".strip()
+
+
+class MongoCommandTimer(monitoring.CommandListener):
+    """Listener de pymongo: los eventos llegan en el hilo que emitió el comando."""
+
+    def __init__(self):
+        self._shapes = {}
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        with self._lock:
+            self._shapes[event.request_id] = _mongo_shape(event.command, event.command_name)
+
+    def _finish(self, event):
+        with self._lock:
+            shape = self._shapes.pop(event.request_id, event.command_name)
+        record("mongo", event.duration_micros / 1e6, event.command_name, shape)
+
+    def succeeded(self, event):
+        self._finish(event)
+
+    def failed(self, event):
+        self._finish(event)
+
+
+# ----------------------------- JSON -------------------------------------------
+class TimedJSONProvider(DefaultJSONProvider):
+    def dumps(self, obj, **kwargs):
+        t0 = time.perf_counter()
+        try:
+            return super().dumps(obj, **kwargs)
+        finally:
+            record("serialize", time.perf_counter() - t0, "json")
+
+
+# ----------------------------- Flask ------------------------------------------
+def _route():
+    rule = request.url_rule
+    return rule.rule if rule is not None else "unmatched"
+
+
+def init_app(app):
+    app.json = TimedJSONProvider(app)
+
+    @app.before_request
+    def _start_timer():
+        g._t0 = time.perf_counter()
+        g._timings = {}
+        g._shapes = []
+
+    @app.after_request
+    def _observe(response):
+        if "_t0" not in g:
+            return response
+        total = time.perf_counter() - g._t0
+        route = _route()
+        REQUEST_SECONDS.observe(total, route, request.method, str(response.status_code))
+        for component, seconds in g._timings.items():
+            COMPONENT_SECONDS.observe(seconds, route, component)
+        if total >= SLOW_REQUEST_SECONDS:
+            breakdown = {c: round(s * 1000, 1) for c, s in g._timings.items()}
+            breakdown["other"] = round((total - sum(g._timings.values())) * 1000, 1)
+            app.logger.warning(
+                "petición lenta %s %s %d %.1f ms desglose=%s consultas=%s",
+                request.method, route, response.status_code, total * 1000,
+                breakdown, g._shapes,
+            )
+        return response
+
+
+def render_prometheus(gauges=None):
+    """Texto Prometheus: histogramas + gauges planos {nombre: valor}."""
+    parts = [REQUEST_SECONDS.render(), COMPONENT_SECONDS.render(), OPERATION_SECONDS.render()]
+    for name, value in (gauges or {}).items():
+        if isinstance(value, bool):
+            value = int(value)
+        if isinstance(value, (int, float)):
+            parts.append(f"# TYPE {name} gauge\n{name} {value}")
+    return "\n".join(parts) + "\n"
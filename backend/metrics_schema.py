@@ -0,0 +1,185 @@
+"""Esquema canónico de `metrics_log` y backfill de documentos legados.
+
+Todo doc guardado tiene la forma que arma `metric_fields` (tipo Cardio/Fuerza,
+horas numéricas, fecha a medianoche y year/month/week derivados). Mongo lo
+exige con un validador $jsonSchema, así la lectura serializa sin reparar nada.
+Los docs anteriores al validador se reparan o se mueven a
+`metrics_log_quarantine` con `backfill()`, que avanza por lotes de _id y
+guarda un checkpoint para retomar si se interrumpe.
+"""
+import math
+from datetime import datetime
+
+from bson import ObjectId
+from pymongo import DeleteOne, ReplaceOne, UpdateOne
+
+METRIC_TYPES = ("Cardio", "Fuerza")
+QUARANTINE = "metrics_log_quarantine"
+BACKFILL_STATE_ID = "metrics_log_backfill"
+
+VALIDATOR = {"$jsonSchema": {
+    "bsonType": "object",
+    "required": ["user_id", "type", "hours", "date", "year", "month", "week", "created_at"],
+    "properties": {
+        "user_id": {"bsonType": "string"},
+        "email": {"bsonType": ["string", "null"]},
+        "type": {"enum": list(METRIC_TYPES)},
+        "hours": {"bsonType": "number"},
+        "date": {"bsonType": "date"},
+        "year": {"bsonType": "int"},
+        "month": {"bsonType": "int", "minimum": 1, "maximum": 12},
+        "week": {"bsonType": "int", "minimum": 1, "maximum": 53},
+        "created_at": {"bsonType": "date"},
+        "idempotency_key": {"bsonType": "string"},
+    },
+}}
+
+# Forma final del item de la API: Mongo entrega la fecha ya como YYYY-MM-DD
+ITEM_PROJECTION = {"type": 1, "hours": 1,
+                   "date": {"$dateToString": {"format": "%Y-%m-%d", "date": "$date"}}}
+
+
+def metric_fields(mtype, hours, dt):
+    """Campos canónicos de un entrenamiento (dt ya normalizado a medianoche)."""
+    return {
+        "type": mtype,
+        "hours": hours,
+        "date": dt,
+        "year": dt.year,
+        "month": dt.month,
+        "week": dt.isocalendar().week,
+    }
+
+
+# ----------------------------- Reparación -------------------------------------
+def _repair_date(raw):
+    if isinstance(raw, datetime):
+        dt = raw
+    elif isinstance(raw, str):
+        raw = raw.strip()
+        if len(raw) == 10 and raw[4] == "-" and raw[7] == "-":
+            dt = datetime.strptime(raw, "%Y-%m-%d")
+        else:
+            dt = datetime.fromisoformat(raw.replace("Z", "+00:00"))
+    else:
+        raise ValueError("date ausente")
+    return datetime(dt.year, dt.month, dt.day)
+
+
+def repair(doc):
+    """Devuelve ($set con los campos a corregir, None) o (None, motivo) si no
+    se puede reparar. Un doc canónico devuelve ({}, None)."""
+    user_id = doc.get("user_id")
+    if user_id is None or user_id == "":
+        return None, "sin user_id"
+
+    mtype = doc.get("type")
+    if not isinstance(mtype, str) or mtype.strip().capitalize() not in METRIC_TYPES:
+        return None, "type inválido"
+    mtype = mtype.strip().capitalize()
+
+    hours = doc.get("hours")
+    try:
+        if isinstance(hours, bool):
+            raise ValueError
+        hours = float(hours)
+        if not math.isfinite(hours):
+            raise ValueError
+    except (TypeError, ValueError):
+        return None, "hours inválido"
+
+    try:
+        dt = _repair_date(doc.get("date"))
+    except ValueError:
+        return None, "date inválido"
+
+    want = {"user_id": str(user_id), **metric_fields(mtype, hours, dt)}
+    created = doc.get("created_at")
+    if not isinstance(created, datetime):
+        _id = doc.get("_id")
+        want["created_at"] = (_id.generation_time.replace(tzinfo=None)
+                              if isinstance(_id, ObjectId) else datetime.utcnow())
+    key = doc.get("idempotency_key")
+    if key is not None and not isinstance(key, str):
+        want["idempotency_key"] = str(key)
+
+    changes = {}
+    for k, v in want.items():
+        cur = doc.get(k)
+        if k == "hours":
+            same = isinstance(cur, (int, float)) and not isinstance(cur, bool) and cur == v
+        else:
+            same = type(cur) is type(v) and cur == v
+        if not same:
+            changes[k] = v
+    return changes, None
+
+
+# ----------------------------- Backfill ---------------------------------------
+def backfill(src, quarantine, state, batch_size=1000, on_users=None, log=print):
+    """Repara/cuarentena metrics_log por lotes de _id ascendente.
+
+    `state` guarda el último _id procesado; si el proceso muere, la siguiente
+    ejecución retoma desde ahí. `on_users(set)` recibe los usuarios tocados en
+    cada lote (p. ej. para reconstruir sus rollups). Devuelve los contadores.
+    """
+    st = state.find_one({"_id": BACKFILL_STATE_ID}) or {}
+    if st.get("done"):
+        return st
+    last_id = st.get("last_id")
+    totals = {k: st.get(k, 0) for k in ("scanned", "repaired", "quarantined")}
+
+    while True:
+        q = {"_id": {"$gt": last_id}} if last_id is not None else {}
+        batch = list(src.find(q).sort("_id", 1).limit(batch_size))
+        if not batch:
+            break
+        fixes, moved, users = [], [], set()
+        for doc in batch:
+            changes, reason = repair(doc)
+            if reason:
+                # Upsert por _id: si un lote se reintenta, la copia no se duplica
+                moved.append(ReplaceOne({"_id": doc["_id"]},
+                                        {**doc, "quarantine_reason": reason,
+                                         "quarantined_at": datetime.utcnow()},
+                                        upsert=True))
+                fixes.append(DeleteOne({"_id": doc["_id"]}))
+            elif changes:
+                fixes.append(UpdateOne({"_id": doc["_id"]}, {"$set": changes}))
+            else:
+                continue
+            if doc.get("user_id") is not None:
+                users.add(str(doc["user_id"]))
+        # Primero la copia en cuarentena, luego el borrado: nunca se pierde un doc
+        if moved:
+            quarantine.bulk_write(moved, ordered=False)
+        if fixes:
+            src.bulk_write(fixes, ordered=False)
+        if users and on_users:
+            on_users(users)
+
+        last_id = batch[-1]["_id"]
+        totals["scanned"] += len(batch)
+        totals["quarantined"] += len(moved)
+        totals["repaired"] += len(fixes) - len(moved)
+        state.update_one({"_id": BACKFILL_STATE_ID},
+                         {"$set": {"last_id": last_id, **totals,
+                                   "updated_at": datetime.utcnow()}},
+                         upsert=True)
+        log(f"backfill metrics_log: {totals['scanned']} revisados, "
+            f"{totals['repaired']} reparados, {totals['quarantined']} en cuarentena")
+
+    state.update_one({"_id": BACKFILL_STATE_ID},
+                     {"$set": {**totals, "done": True, "updated_at": datetime.utcnow()}},
+                     upsert=True)
+    return totals
+
+
+def apply_validator(db, level="strict"):
+    """Instala (o actualiza) el validador $jsonSchema de metrics_log."""
+    if "metrics_log" not in db.list_collection_names():
+        db.create_collection("metrics_log", validator=VALIDATOR,
+                             validationLevel=level, validationAction="error")
+    else:
+        db.command("collMod", "metrics_log", validator=VALIDATOR,
+                   validationLevel=level, validationAction="error")
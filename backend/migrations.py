@@ -0,0 +1,198 @@
+"""Migraciones versionadas de Postgres y Mongo (se ejecutan una vez por deploy).
+
+    python migrations.py            # aplica lo pendiente
+    python migrations.py --status   # muestra versión actual vs esperada
+
+El arranque de la app no ejecuta DDL: solo compara versiones con
+`check_schema()`, que es una consulta por base.
+"""
+import os
+import sys
+import time
+from datetime import datetime
+
+import indexes
+import metrics_schema
+from extensions import mdb, metrics, metrics_log, pg_pool, response_cache, rollups
+
+# Lock consultivo para que dos deploys simultáneos no migren a la vez
+PG_ADVISORY_LOCK = 5_020_001
+
+
+class SchemaOutdated(RuntimeError):
+    """La base está detrás de la versión que espera este código."""
+
+
+# ----------------------------- Postgres ---------------------------------------
+def _pg_create_users(cur):
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS users(
+      id SERIAL PRIMARY KEY,
+      email TEXT UNIQUE NOT NULL,
+      password_hash TEXT NOT NULL,
+      created_at TIMESTAMP DEFAULT NOW()
+    );
+    """)
+
+
+def _pg_reset_token_columns(cur):
+    # Columnas modeladas en app/models/user.py
+    cur.execute("""
+    ALTER TABLE users
+      ADD COLUMN IF NOT EXISTS reset_token VARCHAR(256),
+      ADD COLUMN IF NOT EXISTS reset_token_exp TIMESTAMP;
+    """)
+
+
+PG_MIGRATIONS = [
+    (1, "create_users", _pg_create_users),
+    (2, "reset_token_columns", _pg_reset_token_columns),
+]
+
+
+# ----------------------------- Mongo ------------------------------------------
+def _mongo_seed_dashboard_metrics(db):
+    if metrics.count_documents({}) == 0:
+        metrics.insert_many([
+            {"name": "Entrenamientos completados", "value": 24},
+            {"name": "Horas totales de entrenamiento", "value": 18},
+            {"name": "Promedio de calorías por sesión", "value": 420},
+            {"name": "Racha activa (días)", "value": 6},
+            {"name": "Sesiones de fuerza", "value": 14},
+            {"name": "Sesiones de cardio", "value": 10}
+        ])
+
+
+def _mongo_rollups_backfill(db):
+    # Historial previo a los rollups: poblarlos una vez
+    if rollups.col.estimated_document_count() == 0 and metrics_log.estimated_document_count() > 0:
+        rollups.rebuild()
+
+
+def _mongo_metrics_log_normalize(db):
+    # Repara o pone en cuarentena los docs legados; retoma desde el checkpoint
+    def resync(users):
+        # Reparar puede cambiar tipo/bucket/horas: se recalculan esos usuarios
+        for user_id in users:
+            rollups.rebuild(user_id)
+            response_cache.invalidate(user_id)
+
+    metrics_schema.backfill(
+        metrics_log, db[metrics_schema.QUARANTINE], db.migration_state,
+        batch_size=int(os.getenv("BACKFILL_BATCH_SIZE", 1000)), on_users=resync,
+    )
+
+
+def _mongo_metrics_log_validator(db):
+    # Después del backfill: desde aquí Mongo rechaza docs fuera del esquema
+    metrics_schema.apply_validator(db)
+
+
+def _mongo_user_activity_drop_email(db):
+    # Las vistas globales ya no guardan el email de cada usuario (ver views.py)
+    db.user_activity.update_many({"email": {"$exists": True}}, {"$unset": {"email": ""}})
+    db.global_views.delete_one({"_id": "dashboard"})
+
+
+MONGO_MIGRATIONS = [
+    (1, "seed_dashboard_metrics", _mongo_seed_dashboard_metrics),
+    (2, "rollups_backfill", _mongo_rollups_backfill),
+    (3, "metrics_log_normalize", _mongo_metrics_log_normalize),
+    (4, "metrics_log_validator", _mongo_metrics_log_validator),
+    (5, "user_activity_drop_email", _mongo_user_activity_drop_email),
+]
+
+PG_VERSION = PG_MIGRATIONS[-1][0]
+MONGO_VERSION = MONGO_MIGRATIONS[-1][0]
+
+
+# ----------------------------- Ledger -----------------------------------------
+def _pg_current(cur):
+    cur.execute("SELECT to_regclass('schema_migrations') AS t;")
+    if cur.fetchone()["t"] is None:
+        return 0
+    cur.execute("SELECT COALESCE(MAX(version), 0) AS v FROM schema_migrations;")
+    return cur.fetchone()["v"]
+
+
+def _mongo_current():
+    doc = mdb.schema_migrations.find_one(sort=[("_id", -1)])
+    return doc["_id"] if doc else 0
+
+
+def current_versions():
+    with pg_pool.cursor() as cur:
+        pg_v = _pg_current(cur)
+    return {"postgres": pg_v, "mongo": _mongo_current()}
+
+
+def check_schema():
+    """Fast path del arranque: lanza SchemaOutdated si falta migrar."""
+    v = current_versions()
+    if v["postgres"] < PG_VERSION or v["mongo"] < MONGO_VERSION:
+        raise SchemaOutdated(
+            f"esquema desactualizado (postgres {v['postgres']}/{PG_VERSION}, "
+            f"mongo {v['mongo']}/{MONGO_VERSION}): ejecuta `python migrations.py`"
+        )
+    return v
+
+
+def migrate(log=print):
+    """Aplica migraciones pendientes. Devuelve la lista de pasos ejecutados."""
+    applied = []
+    with pg_pool.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_lock(%s);", (PG_ADVISORY_LOCK,))
+            try:
+                cur.execute("""
+                CREATE TABLE IF NOT EXISTS schema_migrations(
+                  version INTEGER PRIMARY KEY,
+                  name TEXT NOT NULL,
+                  applied_at TIMESTAMP DEFAULT NOW()
+                );
+                """)
+                current = _pg_current(cur)
+                for version, name, fn in PG_MIGRATIONS:
+                    if version <= current:
+                        continue
+                    t0 = time.perf_counter()
+                    conn.autocommit = False
+                    try:
+                        fn(cur)
+                        cur.execute(
+                            "INSERT INTO schema_migrations(version, name) VALUES (%s, %s);",
+                            (version, name),
+                        )
+                        conn.commit()
+                    except Exception:
+                        conn.rollback()
+                        raise
+                    finally:
+                        conn.autocommit = True
+                    applied.append(f"postgres {version} {name}")
+                    log(f"postgres {version} {name} ({time.perf_counter() - t0:.2f}s)")
+
+                # Mongo: los índices declarados se aseguran en cada deploy
+                indexes.ensure_indexes(mdb)
+                current = _mongo_current()
+                for version, name, fn in MONGO_MIGRATIONS:
+                    if version <= current:
+                        continue
+                    t0 = time.perf_counter()
+                    fn(mdb)
+                    mdb.schema_migrations.insert_one(
+                        {"_id": version, "name": name, "applied_at": datetime.utcnow()})
+                    applied.append(f"mongo {version} {name}")
+                    log(f"mongo {version} {name} ({time.perf_counter() - t0:.2f}s)")
+            finally:
+                cur.execute("SELECT pg_advisory_unlock(%s);", (PG_ADVISORY_LOCK,))
+    return applied
+
+
+if __name__ == "__main__":
+    if "--status" in sys.argv:
+        v = current_versions()
+        print(f"postgres {v['postgres']}/{PG_VERSION}  mongo {v['mongo']}/{MONGO_VERSION}")
+        sys.exit(0 if v["postgres"] >= PG_VERSION and v["mongo"] >= MONGO_VERSION else 1)
+    steps = migrate()
+    print(f"{len(steps)} migraciones aplicadas")
@@ -0,0 +1,163 @@
+"""Outbox de correos: los handlers encolan y un hilo de fondo envía.
+
+Los mensajes se guardan en Mongo (colección `mail_outbox`) para sobrevivir a
+reinicios. El sender reclama lotes de forma atómica (seguro con varios
+workers), reutiliza una sola conexión SMTP mientras haya mensajes y reintenta
+con backoff exponencial.
+"""
+import os
+from datetime import datetime, timedelta
+
+from flask_mail import Message
+from pymongo import ReturnDocument
+
+from background import BackgroundWorker
+from instrumentation import timed
+
+PENDING, SENDING, SENT, FAILED = "pending", "sending", "sent", "failed"
+
+
+class Outbox(BackgroundWorker):
+    thread_name = "mail-outbox"
+    error_message = "Fallo drenando el outbox de correos"
+
+    def __init__(self, collection, mail, app=None, batch_size=20, max_attempts=5,
+                 backoff_base=2.0, backoff_max=300.0, lease_seconds=60,
+                 poll_interval=5.0):
+        super().__init__(app, interval=poll_interval)
+        self.col = collection
+        self.mail = mail
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.lease_seconds = lease_seconds
+        self._init_stats(enqueued=0, sent=0, retried=0, failed=0, batches=0,
+                         last_latency_seconds=0.0)
+
+    def init_app(self, app):
+        self.app = app
+        self.batch_size = int(os.getenv("OUTBOX_BATCH_SIZE", self.batch_size))
+        self.max_attempts = int(os.getenv("OUTBOX_MAX_ATTEMPTS", self.max_attempts))
+        self.interval = float(os.getenv("OUTBOX_POLL_INTERVAL", self.interval))
+
+    # ----------------------------- Productor ----------------------------------
+    def enqueue(self, subject, recipients, body):
+        now = datetime.utcnow()
+        self.col.insert_one({
+            "subject": subject,
+            "recipients": list(recipients),
+            "body": body,
+            "status": PENDING,
+            "attempts": 0,
+            "next_attempt_at": now,
+            "created_at": now,
+        })
+        self._bump(enqueued=1)
+        self.start()
+        self.wake()
+
+    # ----------------------------- Consumidor ---------------------------------
+    def _claim(self):
+        """Reclama un mensaje listo (o con lease vencido) de forma atómica."""
+        now = datetime.utcnow()
+        return self.col.find_one_and_update(
+            {"$or": [
+                {"status": PENDING, "next_attempt_at": {"$lte": now}},
+                {"status": SENDING, "locked_until": {"$lt": now}},
+            ]},
+            {"$set": {"status": SENDING,
+                      "locked_until": now + timedelta(seconds=self.lease_seconds)}},
+            sort=[("next_attempt_at", 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    def _claim_batch(self):
+        batch = []
+        while len(batch) < self.batch_size:
+            doc = self._claim()
+            if doc is None:
+                break
+            batch.append(doc)
+        return batch
+
+    def _mark_sent(self, doc):
+        now = datetime.utcnow()
+        # El cuerpo puede llevar tokens (reset de contraseña): no se guarda tras
+        # enviarlo, y el doc expira por el índice TTL de sent_at (indexes.py)
+        self.col.update_one({"_id": doc["_id"]},
+                            {"$set": {"status": SENT, "sent_at": now},
+                             "$unset": {"locked_until": "", "body": ""}})
+        with self._stats_lock:
+            self._stats["sent"] += 1
+            self._stats["last_latency_seconds"] = (now - doc["created_at"]).total_seconds()
+
+    def _mark_failed(self, doc, err):
+        attempts = doc.get("attempts", 0) + 1
+        if attempts >= self.max_attempts:
+            update = {"status": FAILED}
+            self._bump(failed=1)
+        else:
+            delay = min(self.backoff_base ** attempts, self.backoff_max)
+            update = {"status": PENDING,
+                      "next_attempt_at": datetime.utcnow() + timedelta(seconds=delay)}
+            self._bump(retried=1)
+        update.update({"attempts": attempts, "last_error": str(err)[:500]})
+        self.col.update_one({"_id": doc["_id"]},
+                            {"$set": update, "$unset": {"locked_until": ""}})
+
+    def drain(self):
+        """Envía todo lo que esté listo reutilizando una conexión SMTP.
+
+        Devuelve la cantidad de mensajes enviados. Se puede llamar de forma
+        síncrona (p. ej. `flask outbox-drain` contra MailHog).
+        """
+        sent = 0
+        batch = self._claim_batch()
+        if not batch:
+            return 0
+        with self.app.app_context():
+            try:
+                conn_ctx = self.mail.connect()
+                with timed("smtp", "connect"):
+                    conn = conn_ctx.__enter__()
+            except Exception as e:
+                # Relay caído: todos los reclamados vuelven a la cola con backoff
+                for doc in batch:
+                    self._mark_failed(doc, e)
+                return 0
+            try:
+                while batch:
+                    self._bump(batches=1)
+                    for doc in batch:
+                        msg = Message(doc["subject"], recipients=doc["recipients"])
+                        msg.body = doc["body"]
+                        try:
+                            with timed("smtp", "send"):
+                                conn.send(msg)
+                        except Exception as e:
+                            self._mark_failed(doc, e)
+                        else:
+                            self._mark_sent(doc)
+                            sent += 1
+                    batch = self._claim_batch()
+            finally:
+                try:
+                    conn_ctx.__exit__(None, None, None)
+                except Exception:
+                    pass
+        return sent
+
+    def run_once(self):
+        self.drain()
+
+    def stats(self):
+        out = self._snapshot()
+        out["depth"] = self.col.count_documents({"status": {"$in": [PENDING, SENDING]}})
+        oldest = self.col.find_one({"status": PENDING}, {"created_at": 1},
+                                   sort=[("created_at", 1)])
+        out["oldest_pending_seconds"] = (
+            (datetime.utcnow() - oldest["created_at"]).total_seconds() if oldest else 0.0
+        )
+        return out
+
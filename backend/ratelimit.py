@@ -0,0 +1,200 @@
+"""Token bucket por IP y por email para los endpoints de autenticación.
+
+Cada regla es "N/S": ráfaga de N intentos que se recarga a razón de N cada S
+segundos. Al superar cualquier regla se lanza RateLimited (→ 429 +
+Retry-After) antes de tocar Postgres o bcrypt. Los buckets viven en Mongo
+(`rate_limits`, compartidos entre workers) o en memoria; en memoria cada worker
+tiene los suyos y el límite efectivo se multiplica por WEB_WORKERS, por eso
+con varios workers el backend por defecto es Mongo.
+
+    RATE_LIMIT_LOGIN_IP=20/60      # 20 intentos por IP, recarga en 60 s
+    RATE_LIMIT_LOGIN_EMAIL=5/300
+"""
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from functools import wraps
+
+from flask import request
+from pymongo import ReturnDocument
+
+from hashing import HashingBusy
+
+DEFAULT_RULES = {
+    "login":    {"ip": "20/60", "email": "5/300"},
+    "register": {"ip": "5/300", "email": "3/3600"},
+    "forgot":   {"ip": "5/300", "email": "3/900"},
+}
+
+
+class RateLimited(Exception):
+    """Se agotó el bucket de una regla; el cliente debe esperar `retry_after`."""
+
+    def __init__(self, retry_after=1, rule=""):
+        super().__init__(f"límite de intentos ({rule})")
+        self.retry_after = retry_after
+        self.rule = rule
+
+
+def parse_rule(spec):
+    """"N/S" → (burst, tokens por segundo)."""
+    n, s = spec.split("/")
+    return int(n), int(n) / float(s)
+
+
+class MemoryBuckets:
+    """En proceso: buckets en un LRU acotado (un bucket desalojado vuelve lleno)."""
+
+    def __init__(self, max_keys=100_000):
+        self.max_keys = max_keys
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, burst, rate, now=None):
+        """Consume un token. Devuelve 0 si se permitió o los segundos a esperar."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            tokens, ts = self._data.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - ts) * rate)
+            if tokens >= 1:
+                self._data[key] = (tokens - 1, now)
+                wait = 0.0
+            else:
+                self._data[key] = (tokens, now)
+                wait = (1 - tokens) / rate
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_keys:
+                self._data.popitem(last=False)
+        return wait
+
+    def __len__(self):
+        return len(self._data)
+
+
+class MongoBuckets:
+    """Compartido entre workers: un doc por clave en `rate_limits`, actualizado
+    con un update de pipeline atómico (recarga + consumo en el servidor)."""
+
+    def __init__(self, db):
+        self.db = db
+
+    # El índice TTL de rate_limits está declarado en indexes.py
+    @property
+    def col(self):
+        return self.db.rate_limits
+
+    def take(self, key, burst, rate, now=None):
+        now = time.time() if now is None else now
+        refilled = {"$min": [burst, {"$add": [
+            {"$ifNull": ["$tokens", burst]},
+            {"$multiply": [{"$max": [0, {"$subtract": [now, {"$ifNull": ["$ts", now]}]}]},
+                           rate]},
+        ]}]}
+        doc = self.col.find_one_and_update(
+            {"_id": key},
+            [
+                {"$set": {"_t": refilled}},
+                {"$set": {
+                    "ok": {"$gte": ["$_t", 1]},
+                    "tokens": {"$cond": [{"$gte": ["$_t", 1]}, {"$subtract": ["$_t", 1]}, "$_t"]},
+                    "ts": now,
+                    # Tras burst/rate segundos el bucket estaría lleno: se puede borrar
+                    "expires_at": datetime.utcnow() + timedelta(seconds=burst / rate),
+                }},
+                {"$unset": "_t"},
+            ],
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        return 0.0 if doc["ok"] else (1 - doc["tokens"]) / rate
+
+    def __len__(self):
+        return 0
+
+
+class RateLimiter:
+    def __init__(self, backend, rules=None, enabled=True, trust_proxy=True, hasher=None):
+        self.backend = backend
+        self.rules = {name: {k: parse_rule(v) for k, v in keys.items()}
+                      for name, keys in (rules or DEFAULT_RULES).items()}
+        self.enabled = enabled
+        self.trust_proxy = trust_proxy
+        self.hasher = hasher
+        self._stats_lock = threading.Lock()
+        self._stats = {"allowed": 0, "limited": 0, "shed": 0}
+
+    def _bump(self, name, rule=None):
+        with self._stats_lock:
+            self._stats[name] += 1
+            if rule:
+                k = f"limited_{rule}"
+                self._stats[k] = self._stats.get(k, 0) + 1
+
+    def client_ip(self):
+        # nginx define X-Real-IP (ver nginx/nginx.conf)
+        if self.trust_proxy and request.headers.get("X-Real-IP"):
+            return request.headers["X-Real-IP"].strip()
+        return request.remote_addr or "?"
+
+    @staticmethod
+    def _email():
+        data = request.get_json(silent=True)
+        if isinstance(data, dict) and isinstance(data.get("email"), str):
+            return data["email"].strip().lower() or None
+        return None
+
+    def check(self, name, admission=False):
+        """Consume un token de cada regla de `name`; lanza RateLimited, o
+        HashingBusy si `admission` y la cola de bcrypt está llena."""
+        keys = {"ip": self.client_ip(), "email": self._email()}
+        for key_name, (burst, rate) in self.rules.get(name, {}).items():
+            value = keys.get(key_name)
+            if value is None:
+                continue
+            wait = self.backend.take(f"{name}:{key_name}:{value}", burst, rate)
+            if wait:
+                self._bump("limited", f"{name}_{key_name}")
+                raise RateLimited(max(1, math.ceil(wait)), f"{name}/{key_name}")
+        # Control de admisión: con la cola de bcrypt llena no se empieza el trabajo
+        if admission and self.hasher is not None and self.hasher.saturated():
+            self._bump("shed")
+            raise HashingBusy(self.hasher.retry_after)
+        self._bump("allowed")
+
+    def limit(self, name, admission=False):
+        """Decorador de vista: `@rate_limiter.limit("login", admission=True)`.
+        `admission` solo en los endpoints que usan bcrypt."""
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                if self.enabled:
+                    self.check(name, admission)
+                return view(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def stats(self):
+        with self._stats_lock:
+            out = dict(self._stats)
+        out.update({"enabled": self.enabled, "keys": len(self.backend)})
+        return out
+
+
+def limiter_from_env(mdb, hasher=None):
+    rules = {name: {k: os.getenv(f"RATE_LIMIT_{name.upper()}_{k.upper()}", v)
+                    for k, v in keys.items()}
+             for name, keys in DEFAULT_RULES.items()}
+    shared = int(os.getenv("WEB_WORKERS", 1)) > 1
+    if os.getenv("RATE_LIMIT_BACKEND", "mongo" if shared else "memory") == "mongo":
+        backend = MongoBuckets(mdb)
+    else:
+        backend = MemoryBuckets(max_keys=int(os.getenv("RATE_LIMIT_MAX_KEYS", 100_000)))
+    return RateLimiter(
+        backend, rules,
+        enabled=os.getenv("RATE_LIMIT_ENABLED", "1") == "1",
+        trust_proxy=os.getenv("RATE_LIMIT_TRUST_PROXY", "1") == "1",
+        hasher=hasher,
+    )
@@ -0,0 +1,100 @@
+"""Formato columnar opcional y compresión gzip de respuestas.
+
+`?format=columnar` (o `Accept: application/vnd.metrics.columnar+json`) cambia
+las listas de objetos por arreglos paralelos por campo; los campos de baja
+cardinalidad (type) van codificados con diccionario:
+
+    {"format": "columnar", "count": 3,
+     "columns": {"_id": [...], "type": [0, 1, 0], "hours": [...], "date": [...]},
+     "dictionaries": {"type": ["Cardio", "Fuerza"]}}
+"""
+import gzip
+import os
+
+from flask import request
+
+from instrumentation import timed
+
+COLUMNAR_MIMETYPE = "application/vnd.metrics.columnar+json"
+GZIP_MIN_BYTES = int(os.getenv("GZIP_MIN_BYTES", 1024))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", 5))
+_COMPRESSIBLE = ("application/json", "text/plain", "text/csv", COLUMNAR_MIMETYPE)
+
+
+# ----------------------------- Columnar ---------------------------------------
+def wants_columnar():
+    fmt = request.args.get("format")
+    if fmt:
+        return fmt == "columnar"
+    return request.accept_mimetypes.best_match(
+        ["application/json", COLUMNAR_MIMETYPE]) == COLUMNAR_MIMETYPE
+
+
+def negotiated_format():
+    """Parte de la clave de caché: la misma URL puede negociar otro formato."""
+    return "columnar" if wants_columnar() else "json"
+
+
+class ColumnBuilder:
+    """Acumula filas en columnas; `encoded` son los campos con diccionario."""
+
+    def __init__(self, fields, encoded=()):
+        self.fields = fields
+        self.columns = {f: [] for f in fields}
+        self.dictionaries = {f: {} for f in encoded}
+        self.count = 0
+
+    def append(self, row):
+        for f in self.fields:
+            v = row[f]
+            codes = self.dictionaries.get(f)
+            if codes is not None:
+                v = codes.setdefault(v, len(codes))
+            self.columns[f].append(v)
+        self.count += 1
+
+    def extend(self, rows):
+        for row in rows:
+            self.append(row)
+        return self
+
+    def to_dict(self):
+        return {
+            "format": "columnar",
+            "count": self.count,
+            "columns": self.columns,
+            "dictionaries": {f: list(codes) for f, codes in self.dictionaries.items()},
+        }
+
+
+def columnar(rows, fields, encoded=()):
+    return ColumnBuilder(fields, encoded).extend(rows).to_dict()
+
+
+# ----------------------------- gzip -------------------------------------------
+def _compressible(response):
+    return (response.status_code == 200
+            and not response.direct_passthrough
+            and not response.is_streamed
+            and "Content-Encoding" not in response.headers
+            and response.mimetype in _COMPRESSIBLE
+            and request.accept_encodings["gzip"] > 0)
+
+
+def init_app(app):
+    @app.after_request
+    def _gzip(response):
+        if not _compressible(response):
+            return response
+        response.vary.add("Accept-Encoding")
+        body = response.get_data()
+        if len(body) < GZIP_MIN_BYTES:
+            return response
+        with timed("compress", "gzip"):
+            response.set_data(gzip.compress(body, compresslevel=GZIP_LEVEL))
+        response.headers["Content-Encoding"] = "gzip"
+        # Otra representación del mismo recurso: el ETag pasa a ser débil
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
@@ -0,0 +1,153 @@
+"""Rollups de horas por usuario, mantenidos en cada escritura de métricas.
+
+Un documento por (user_id, period, year, bucket, type) en `metrics_rollup`:
+period="month" → bucket es el mes; period="week" → bucket es la semana ISO.
+Cada escritura en `metrics_log` aplica un $inc atómico sobre sus dos buckets,
+así los endpoints de resumen leen unos pocos documentos precalculados.
+"""
+from pymongo import DESCENDING, UpdateOne
+
+MONTH, WEEK = "month", "week"
+
+
+def _buckets(doc):
+    """Buckets (period, year, bucket) que afecta un doc de metrics_log."""
+    return [(MONTH, doc.get("year"), doc.get("month")),
+            (WEEK, doc.get("year"), doc.get("week"))]
+
+
+def _countable(doc):
+    # Mismo criterio que los resúmenes originales: type y hours presentes
+    return (doc is not None and doc.get("type") is not None
+            and isinstance(doc.get("hours"), (int, float)))
+
+
+class RollupStore:
+    def __init__(self, collection, source):
+        self.col = collection
+        self.src = source  # metrics_log
+
+    # ----------------------------- Escritura ----------------------------------
+    def _apply(self, doc, sign):
+        if not _countable(doc):
+            return
+        for period, year, bucket in _buckets(doc):
+            key = {"user_id": doc["user_id"], "period": period,
+                   "year": year, "bucket": bucket, "type": doc["type"]}
+            self.col.update_one(
+                key,
+                {"$inc": {"hours": sign * doc["hours"], "count": sign}},
+                upsert=True,
+            )
+            if sign < 0:
+                self.col.delete_one({**key, "count": {"$lte": 0}})
+
+    def add(self, doc):
+        self._apply(doc, 1)
+
+    def add_many(self, docs):
+        """Suma un lote de docs agrupando por bucket: un upsert por clave."""
+        deltas = {}
+        for doc in docs:
+            if not _countable(doc):
+                continue
+            for period, year, bucket in _buckets(doc):
+                key = (doc["user_id"], period, year, bucket, doc["type"])
+                hours, count = deltas.get(key, (0.0, 0))
+                deltas[key] = (hours + doc["hours"], count + 1)
+        if not deltas:
+            return
+        self.col.bulk_write([
+            UpdateOne({"user_id": u, "period": p, "year": y, "bucket": b, "type": t},
+                      {"$inc": {"hours": h, "count": c}}, upsert=True)
+            for (u, p, y, b, t), (h, c) in deltas.items()
+        ], ordered=False)
+
+    def remove(self, doc):
+        self._apply(doc, -1)
+
+    def move(self, old, new):
+        """Traslada horas entre buckets cuando cambia fecha/tipo/horas."""
+        self.remove(old)
+        self.add(new)
+
+    # ----------------------------- Lectura ------------------------------------
+    def _summary(self, user_id, period, year, bucket):
+        rows = self.col.find(
+            {"user_id": user_id, "period": period, "year": year, "bucket": bucket},
+            {"_id": 0, "type": 1, "hours": 1},
+        )
+        return sorted(({"type": r["type"], "hours": r["hours"]} for r in rows),
+                      key=lambda r: r["type"])
+
+    def month_summary(self, user_id, year, month):
+        return self._summary(user_id, MONTH, year, month)
+
+    def week_summary(self, user_id, year, week):
+        return self._summary(user_id, WEEK, year, week)
+
+    def by_month(self, user_id, limit):
+        """Últimos `limit` meses con datos, del más reciente al más antiguo."""
+        cur = self.col.find(
+            {"user_id": user_id, "period": MONTH},
+            {"_id": 0, "year": 1, "bucket": 1, "type": 1, "hours": 1},
+        ).sort([("year", DESCENDING), ("bucket", DESCENDING)])
+        out = []
+        for r in cur:
+            if not out or (out[-1]["year"], out[-1]["month"]) != (r["year"], r["bucket"]):
+                if len(out) == limit:
+                    break
+                out.append({"year": r["year"], "month": r["bucket"], "summary": []})
+            out[-1]["summary"].append({"type": r["type"], "hours": float(r["hours"])})
+        return out
+
+    # ----------------------------- Mantención ---------------------------------
+    def _expected(self, user_id=None):
+        """Recalcula los rollups desde metrics_log → {clave: (hours, count)}."""
+        match = {"type": {"$exists": True, "$ne": None},
+                 "hours": {"$type": "number"}}
+        if user_id:
+            match["user_id"] = user_id
+        out = {}
+        for period, field in ((MONTH, "$month"), (WEEK, "$week")):
+            pipeline = [
+                {"$match": match},
+                {"$group": {
+                    "_id": {"user_id": "$user_id", "year": "$year",
+                            "bucket": field, "type": "$type"},
+                    "hours": {"$sum": "$hours"},
+                    "count": {"$sum": 1},
+                }},
+            ]
+            for r in self.src.aggregate(pipeline, allowDiskUse=True):
+                k = r["_id"]
+                out[(k["user_id"], period, k["year"], k["bucket"], k["type"])] = (
+                    r["hours"], r["count"])
+        return out
+
+    def rebuild(self, user_id=None):
+        """Reconstruye desde cero (todo o un usuario). Devuelve nº de documentos."""
+        expected = self._expected(user_id)
+        self.col.delete_many({"user_id": user_id} if user_id else {})
+        docs = [
+            {"user_id": u, "period": p, "year": y, "bucket": b, "type": t,
+             "hours": h, "count": c}
+            for (u, p, y, b, t), (h, c) in expected.items()
+        ]
+        for i in range(0, len(docs), 1000):
+            self.col.insert_many(docs[i:i + 1000], ordered=False)
+        return len(docs)
+
+    def verify(self, user_id=None, tolerance=1e-6):
+        """Compara rollups vs metrics_log. Devuelve la lista de diferencias."""
+        expected = self._expected(user_id)
+        actual = {}
+        for r in self.col.find({"user_id": user_id} if user_id else {}):
+            actual[(r["user_id"], r["period"], r["year"], r["bucket"], r["type"])] = (
+                r["hours"], r["count"])
+        diffs = []
+        for key in expected.keys() | actual.keys():
+            exp, act = expected.get(key, (0, 0)), actual.get(key, (0, 0))
+            if abs(exp[0] - act[0]) > tolerance or exp[1] != act[1]:
+                diffs.append({"key": key, "expected": exp, "actual": act})
+        return diffs
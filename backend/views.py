@@ -0,0 +1,210 @@
+"""Vistas materializadas globales para GET /api/dashboard/metrics.
+
+Un hilo de fondo refresca cada `interval` segundos, solo con lo que cambió
+desde la última marca de agua:
+
+1. Usuarios tocados: docs de `metrics_log` con created_at/updated_at posterior
+   a la marca, más las lápidas de borrado (`metrics_tombstones`).
+2. Para cada uno se recalcula su doc en `user_activity` (último día activo y
+   racha actual) con una consulta acotada por índice.
+3. Se rearma el doc compacto `global_views/dashboard` desde `user_activity` y
+   los rollups semanales; el endpoint lee solo ese doc. Las mejores rachas van
+   solo con su puesto: la vista es visible para todo usuario autenticado y no
+   guarda ni expone datos de otros usuarios.
+
+La marca se retrocede `overlap` segundos al consultar: recalcular un usuario
+es idempotente, y así no se pierden docs con created_at anterior a su insert
+(p. ej. los que pasan por el buffer write-behind).
+"""
+import os
+from datetime import date, datetime, timedelta
+
+from pymongo import DESCENDING, ReplaceOne, ReturnDocument
+
+from background import BackgroundWorker
+from instrumentation import timed
+from rollups import WEEK
+
+STATE_ID = "state"
+VIEW_ID = "dashboard"
+STREAK_WINDOW_DAYS = 366
+ACTIVE_WINDOW_DAYS = 7
+TOP_STREAKS = 5
+
+
+def _streak(days, today):
+    """Racha de días consecutivos que termina hoy o ayer (0 si se cortó)."""
+    d = today if today in days else today - timedelta(days=1)
+    n = 0
+    while d in days:
+        n += 1
+        d -= timedelta(days=1)
+    return n
+
+
+class GlobalViews(BackgroundWorker):
+    # Un hilo por proceso; el lease evita refrescos duplicados entre workers
+    thread_name = "global-views"
+    error_message = "Fallo refrescando las vistas globales"
+
+    def __init__(self, db, source, rollup_col, app=None, interval=60.0, overlap=60.0,
+                 lease_seconds=120.0):
+        super().__init__(app, interval)
+        self.db = db
+        self.src = source          # metrics_log
+        self.rollup_col = rollup_col
+        self.overlap = overlap
+        self.lease_seconds = lease_seconds
+        self._init_stats(refreshes=0, users_refreshed=0, skipped=0,
+                         last_refresh_seconds=0.0)
+
+    def init_app(self, app):
+        self.app = app
+        self.interval = float(os.getenv("VIEWS_REFRESH_INTERVAL", self.interval))
+        self.overlap = float(os.getenv("VIEWS_WATERMARK_OVERLAP", self.overlap))
+
+    @property
+    def views(self):
+        return self.db.global_views
+
+    @property
+    def activity(self):
+        return self.db.user_activity
+
+    @property
+    def tombstones(self):
+        return self.db.metrics_tombstones
+
+    # ----------------------------- Escritura (handlers) -----------------------
+    def record_delete(self, user_id):
+        """Lápida para que el próximo refresco recalcule al usuario."""
+        self.tombstones.insert_one({"user_id": user_id, "deleted_at": datetime.utcnow()})
+
+    # ----------------------------- Refresco -----------------------------------
+    def _acquire(self):
+        """Lease en el doc de estado: un solo worker refresca a la vez."""
+        now = datetime.utcnow()
+        self.views.update_one({"_id": STATE_ID}, {"$setOnInsert": {"watermark": None}},
+                              upsert=True)
+        return self.views.find_one_and_update(
+            {"_id": STATE_ID, "$or": [{"locked_until": {"$exists": False}},
+                                      {"locked_until": {"$lt": now}}]},
+            {"$set": {"locked_until": now + timedelta(seconds=self.lease_seconds)}},
+            return_document=ReturnDocument.AFTER,
+        )
+
+    def _touched_users(self, watermark):
+        if watermark is None:
+            # Refresco completo: también los que ya no tienen entrenamientos
+            return set(self.src.distinct("user_id")) | set(self.activity.distinct("_id"))
+        since = watermark - timedelta(seconds=self.overlap)
+        users = set(self.src.distinct("user_id", {"created_at": {"$gt": since}}))
+        users |= set(self.src.distinct("user_id", {"updated_at": {"$gt": since}}))
+        users |= set(self.tombstones.distinct("user_id", {"deleted_at": {"$gt": since}}))
+        return users
+
+    def _user_activity(self, user_id, today):
+        start = datetime.combine(today - timedelta(days=STREAK_WINDOW_DAYS), datetime.min.time())
+        days = {d.date() for d in self.src.distinct("date", {"user_id": user_id,
+                                                             "date": {"$gte": start}})}
+        if not days:
+            return None
+        return {"last_active": datetime.combine(max(days), datetime.min.time()),
+                "current_streak": _streak(days, today)}
+
+    def _rebuild_view(self, today):
+        active_since = datetime.combine(today - timedelta(days=ACTIVE_WINDOW_DAYS - 1),
+                                        datetime.min.time())
+        streak_since = datetime.combine(today - timedelta(days=1), datetime.min.time())
+        year, week = today.year, today.isocalendar().week
+
+        hours = {"Cardio": 0.0, "Fuerza": 0.0}
+        sessions = 0
+        for r in self.rollup_col.aggregate([
+            {"$match": {"period": WEEK, "year": year, "bucket": week}},
+            {"$group": {"_id": "$type", "hours": {"$sum": "$hours"}, "count": {"$sum": "$count"}}},
+        ]):
+            hours[r["_id"]] = round(r["hours"], 2)
+            sessions += r["count"]
+
+        top = [{"rank": i + 1, "days": a["current_streak"]}
+               for i, a in enumerate(self.activity.find(
+                   {"last_active": {"$gte": streak_since}, "current_streak": {"$gt": 0}},
+                   {"_id": 0, "current_streak": 1},
+               ).sort("current_streak", DESCENDING).limit(TOP_STREAKS))]
+
+        metrics = [
+            {"name": "Usuarios activos (7 días)",
+             "value": self.activity.count_documents({"last_active": {"$gte": active_since}})},
+            {"name": "Sesiones esta semana", "value": sessions},
+            {"name": "Horas de cardio esta semana", "value": hours.get("Cardio", 0.0)},
+            {"name": "Horas de fuerza esta semana", "value": hours.get("Fuerza", 0.0)},
+            {"name": "Racha activa más larga (días)", "value": top[0]["days"] if top else 0},
+        ]
+        self.views.replace_one(
+            {"_id": VIEW_ID},
+            {"metrics": metrics, "top_streaks": top, "day": today.isoformat(),
+             "refreshed_at": datetime.utcnow()},
+            upsert=True,
+        )
+
+    def refresh(self, full=False):
+        """Un refresco incremental (o completo). Devuelve usuarios recalculados,
+        o None si otro worker tiene el lease."""
+        state = self._acquire()
+        if state is None:
+            self._bump(skipped=1)
+            return None
+        started = datetime.utcnow()
+        today = date.today()
+        try:
+            with timed("views", "refresh"):
+                users = self._touched_users(None if full else state.get("watermark"))
+                ops = []
+                for user_id in users:
+                    act = self._user_activity(user_id, today)
+                    if act is None:
+                        self.activity.delete_one({"_id": user_id})
+                    else:
+                        # Replace: el doc queda solo con los campos de act
+                        ops.append(ReplaceOne({"_id": user_id}, act, upsert=True))
+                    if len(ops) >= 500:
+                        self.activity.bulk_write(ops, ordered=False)
+                        ops = []
+                if ops:
+                    self.activity.bulk_write(ops, ordered=False)
+                self._rebuild_view(today)
+            self.views.update_one({"_id": STATE_ID},
+                                  {"$set": {"watermark": started},
+                                   "$unset": {"locked_until": ""}})
+        except Exception:
+            self.views.update_one({"_id": STATE_ID}, {"$unset": {"locked_until": ""}})
+            raise
+        with self._stats_lock:
+            self._stats["refreshes"] += 1
+            self._stats["users_refreshed"] += len(users)
+            self._stats["last_refresh_seconds"] = (datetime.utcnow() - started).total_seconds()
+        return len(users)
+
+    # ----------------------------- Lectura ------------------------------------
+    def version(self):
+        """Cambia con cada refresco: entra en la clave/ETag de la caché."""
+        doc = self.views.find_one({"_id": VIEW_ID}, {"refreshed_at": 1})
+        return doc["refreshed_at"].isoformat() if doc else "seed"
+
+    def dashboard(self):
+        """{metrics: [{name, value}], top_streaks: [{rank, days}]} materializado,
+        o None si aún no se calculó."""
+        return self.views.find_one({"_id": VIEW_ID},
+                                   {"_id": 0, "metrics": 1, "top_streaks": 1})
+
+    # ----------------------------- Hilo de fondo ------------------------------
+    def run_once(self):
+        self.refresh()
+
+    def stats(self):
+        out = self._snapshot()
+        doc = self.views.find_one({"_id": VIEW_ID}, {"refreshed_at": 1})
+        out["age_seconds"] = ((datetime.utcnow() - doc["refreshed_at"]).total_seconds()
+                              if doc else -1)
+        return out
@@ -0,0 +1,212 @@
+"""Write-behind de POST /api/metrics: inserts agrupados en un solo insert_many.
+
+El handler valida, asigna el _id y encola el doc; un hilo por proceso vacía el
+buffer cuando junta `max_batch` docs o pasa `max_delay` desde el primero. Al
+vaciar se aplican los rollups y se invalida la caché de cada usuario tocado.
+
+Durabilidad (`WRITE_BEHIND_DURABILITY`):
+- "flush": el handler espera a que su lote quede escrito (201). El lote se
+  vacía apenas encolaron todas las peticiones en curso (ver `incoming()`), sin
+  esperar `max_delay`: agrupa solo las peticiones concurrentes del worker.
+- "enqueue": responde al encolar (202) y agrupa hasta `max_batch`/`max_delay`;
+  es el modo para ingesta de alto volumen. Si el proceso muere antes del
+  flush, se pierden los docs del buffer.
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from bson import ObjectId
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from background import BackgroundWorker
+from instrumentation import timed
+
+FLUSH, ENQUEUE = "flush", "enqueue"
+
+
+class Ticket:
+    """Resultado de un doc encolado; `wait()` devuelve True si quedó escrito."""
+
+    def __init__(self):
+        self._done = threading.Event()
+        self.error = None
+
+    def resolve(self, error=None):
+        self.error = error
+        self._done.set()
+
+    def wait(self, timeout=None):
+        if not self._done.wait(timeout):
+            return None  # sigue en el buffer
+        return self.error is None
+
+
+class WriteBehindBuffer(BackgroundWorker):
+    # Fork-safe: un hilo y un buffer por proceso
+    thread_name = "metrics-write-behind"
+    error_message = "Fallo vaciando el buffer de métricas"
+
+    def __init__(self, collection, rollups, cache, enabled=False, durability=FLUSH,
+                 max_batch=500, max_delay=0.05, max_depth=10_000, ack_timeout=5.0,
+                 app=None):
+        super().__init__(app)
+        self.col = collection
+        self.rollups = rollups
+        self.cache = cache
+        self.enabled = enabled
+        self.durability = durability
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.max_depth = max_depth
+        self.ack_timeout = ack_timeout
+        self._buf = []              # [(doc, ticket)]
+        self._first_at = None
+        self._incoming = 0          # peticiones en curso que aún no encolaron
+        self._cond = threading.Condition()
+        self._init_stats(enqueued=0, flushes=0, flushed=0, failed=0, rejected=0,
+                         max_depth_seen=0, last_flush_seconds=0.0, last_batch_size=0)
+
+    def init_app(self, app):
+        self.app = app
+
+    # ----------------------------- Productor ----------------------------------
+    @contextmanager
+    def incoming(self):
+        """Envuelve la preparación y el `enqueue` del doc en el handler. En modo
+        flush, el consumidor no espera a `max_delay` si no queda ninguna
+        petición en curso. Deshabilitado no toma el lock."""
+        if not self.enabled:
+            yield
+            return
+        with self._cond:
+            self._incoming += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._incoming -= 1
+                if not self._incoming and self._buf:
+                    self._cond.notify()
+
+    def enqueue(self, doc):
+        """Asigna el _id y encola. Devuelve un Ticket, o None si el buffer está
+        lleno (el llamador escribe de forma síncrona)."""
+        self.start()
+        doc.setdefault("_id", ObjectId())
+        ticket = Ticket()
+        with self._cond:
+            if len(self._buf) >= self.max_depth:
+                self._bump(rejected=1)
+                return None
+            if not self._buf:
+                self._first_at = time.monotonic()
+            self._buf.append((doc, ticket))
+            depth = len(self._buf)
+            if depth >= self.max_batch or depth == 1:
+                self._cond.notify()
+        with self._stats_lock:
+            self._stats["enqueued"] += 1
+            self._stats["max_depth_seen"] = max(self._stats["max_depth_seen"], depth)
+        return ticket
+
+    # ----------------------------- Consumidor ---------------------------------
+    def _take_batch(self):
+        """Bloquea hasta tener un lote listo (por tamaño o por tiempo)."""
+        with self._cond:
+            while not self._stop.is_set():
+                if self._buf:
+                    waited = time.monotonic() - self._first_at
+                    if len(self._buf) >= self.max_batch or waited >= self.max_delay:
+                        break
+                    # flush: los que encolaron esperan su 201 y no llega nadie más
+                    if self.durability == FLUSH and not self._incoming:
+                        break
+                    self._cond.wait(self.max_delay - waited)
+                else:
+                    self._cond.wait()
+            return self._swap()
+
+    def _swap(self):
+        batch, self._buf = self._buf[:self.max_batch], self._buf[self.max_batch:]
+        self._first_at = time.monotonic() if self._buf else None
+        return batch
+
+    def _flush(self, batch):
+        if not batch:
+            return
+        docs = [doc for doc, _ in batch]
+        errors = {}
+        t0 = time.perf_counter()
+        try:
+            with timed("write_behind", "flush"):
+                self.col.insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            for we in e.details.get("writeErrors", []):
+                errors[we["index"]] = we.get("errmsg", "error de escritura")
+        except PyMongoError as e:
+            errors = {i: str(e) for i in range(len(docs))}
+        ok = [d for i, d in enumerate(docs) if i not in errors]
+        try:
+            self.rollups.add_many(ok)
+        finally:
+            for user_id in {d["user_id"] for d in ok}:
+                self.cache.invalidate(user_id)
+            for i, (_, ticket) in enumerate(batch):
+                ticket.resolve(errors.get(i))
+        with self._stats_lock:
+            self._stats["flushes"] += 1
+            self._stats["flushed"] += len(ok)
+            self._stats["failed"] += len(errors)
+            self._stats["last_flush_seconds"] = time.perf_counter() - t0
+            self._stats["last_batch_size"] = len(batch)
+        if errors:
+            self.logger.error("write-behind: %d de %d docs no se pudieron guardar",
+                              len(errors), len(docs))
+
+    def _run(self):
+        # Sin intervalo: _take_batch bloquea hasta tener un lote listo
+        while True:
+            batch = self._take_batch()
+            try:
+                self._flush(batch)
+            except Exception:
+                self.logger.exception(self.error_message)
+            if self._stop.is_set() and not batch:
+                return
+
+    def _after_fork(self):
+        self._buf, self._first_at = [], None
+
+    def stop(self, timeout=5.0):
+        """Vacía lo pendiente y detiene el hilo (apagado del worker)."""
+        if self._pid != os.getpid():
+            return
+        with self._cond:
+            self._stop.set()
+            self._cond.notify_all()
+        super().stop(timeout)
+        # Si el hilo no alcanzó a terminar, lo que quede se escribe aquí
+        with self._cond:
+            rest, self._buf = self._buf, []
+        for i in range(0, len(rest), self.max_batch):
+            self._flush(rest[i:i + self.max_batch])
+
+    def stats(self):
+        out = self._snapshot()
+        out.update({"enabled": self.enabled, "depth": len(self._buf),
+                    "durability": self.durability})
+        return out
+
+
+def write_behind_from_env(collection, rollups, cache):
+    return WriteBehindBuffer(
+        collection, rollups, cache,
+        enabled=os.getenv("WRITE_BEHIND", "0") == "1",
+        durability=os.getenv("WRITE_BEHIND_DURABILITY", FLUSH),
+        max_batch=int(os.getenv("WRITE_BEHIND_MAX_BATCH", 500)),
+        max_delay=float(os.getenv("WRITE_BEHIND_MAX_DELAY_MS", 50)) / 1000,
+        max_depth=int(os.getenv("WRITE_BEHIND_MAX_DEPTH", 10_000)),
+        ack_timeout=float(os.getenv("WRITE_BEHIND_ACK_TIMEOUT", 5)),
+    )
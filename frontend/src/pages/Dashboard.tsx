@@ -29,7 +29,7 @@ type SummaryResponse = {
   week: { year: number; week: number; summary: SummaryRow[] };
 };
 
-type ListRes = { items: TrainingItem[] };
+type ListRes = { items: TrainingItem[]; next_cursor?: string | null };
 
 type MonthRow = {
   year: number;
@@ -37,6 +37,12 @@ type MonthRow = {
   summary: { type: string; hours: number }[];
 };
 
+// GET /api/dashboard: todo el dashboard en una sola petición
+type DashboardResponse = SummaryResponse & {
+  months: MonthRow[];
+  recent: ListRes;
+};
+
 export default function Dashboard() {
   const navigate = useNavigate();
 
@@ -50,6 +56,7 @@ export default function Dashboard() {
   // Datos resumen actual y lista
   const [monthData, setMonthData] = useState<SummaryRow[]>([]);
   const [items, setItems] = useState<TrainingItem[]>([]);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
   const [period, setPeriod] = useState<{ year: number; month: number } | null>(null);
 
   // Datos “por mes” (últimos 6)
@@ -76,23 +83,22 @@ export default function Dashboard() {
     loadAll().finally(() => setLoading(false));
   }, [navigate]);
 
+  // Resúmenes + últimos 6 meses + entrenamientos recientes en un solo round trip
+  async function fetchDashboard() {
+    const d = await apiGet<DashboardResponse>("/dashboard?months=6");
+    setMonthData(d?.month?.summary ?? []);
+    setPeriod({
+      year: d?.month?.year ?? new Date().getFullYear(),
+      month: d?.month?.month ?? new Date().getMonth() + 1,
+    });
+    setMonthsChart(toMonthsChart(d?.months ?? []));
+    setItems(d?.recent?.items ?? []);
+    setNextCursor(d?.recent?.next_cursor ?? null);
+  }
+
   async function loadAll() {
     try {
-      // Resumen del MES actual (para gráfico izquierdo)
-      const s = await apiGet<SummaryResponse>("/metrics/summary-current-month");
-      setMonthData(s?.month?.summary ?? []);
-      setPeriod({
-        year: s?.month?.year ?? new Date().getFullYear(),
-        month: s?.month?.month ?? new Date().getMonth() + 1,
-      });
-
-      // Lista
-      const l = await apiGet<ListRes>("/metrics");
-      setItems(l?.items ?? []);
-
-      // Resumen por MES (últimos 6) → gráfico derecho
-      const m = await apiGet<{ months: MonthRow[] }>(`/metrics/summary-by-month?limit=6`);
-      setMonthsChart(toMonthsChart(m.months ?? []));
+      await fetchDashboard();
     } catch (e: any) {
       console.error("Error al cargar dashboard:", e);
       setError("No se pudieron cargar los datos.");
@@ -101,17 +107,26 @@ export default function Dashboard() {
 
   async function reloadMetrics() {
     try {
-      const l = await apiGet<ListRes>("/metrics");
-      setItems(l?.items ?? []);
-      const s = await apiGet<SummaryResponse>("/metrics/summary-current-month");
-      setMonthData(s?.month?.summary ?? []);
-      const m = await apiGet<{ months: MonthRow[] }>(`/metrics/summary-by-month?limit=6`);
-      setMonthsChart(toMonthsChart(m.months ?? []));
+      await fetchDashboard();
     } catch (e) {
       console.error("Error recargando métricas:", e);
     }
   }
 
+  // Lista: páginas siguientes vía /metrics con el cursor del dashboard
+  async function loadMore() {
+    if (!nextCursor) return;
+    try {
+      const l = await apiGet<ListRes>(
+        `/metrics?limit=50&cursor=${encodeURIComponent(nextCursor)}`
+      );
+      setItems((prev) => [...prev, ...(l?.items ?? [])]);
+      setNextCursor(l?.next_cursor ?? null);
+    } catch (e) {
+      console.error("Error cargando más entrenamientos:", e);
+    }
+  }
+
   const handleLogout = () => {
     clearToken();
     navigate("/");
@@ -346,6 +361,17 @@ export default function Dashboard() {
                       ))}
                     </tbody>
                   </table>
+                  {nextCursor && (
+                    <div className="pt-3 text-center">
+                      <button
+                        type="button"
+                        onClick={loadMore}
+                        className="px-4 py-2 text-sm border rounded-lg hover:bg-gray-50"
+                      >
+                        Cargar más
+                      </button>
+                    </div>
+                  )}
                 </div>
               ) : (
                 <p className="text-muted-foreground text-center">Aún no hay registros.</p>